@@ -1,8 +1,8 @@
 from django.contrib import admin
 from .models import (
-    Curso, Promocion, Tema, Material, Inscripcion, 
+    Curso, Promocion, Tema, Material, ArchivoMaterial, DerivadoArchivo, SubidaMaterial, Inscripcion, 
     Asistencia, Pregunta, Examen, RespuestaExamen, RecuperacionExamen,
-    CalificacionExamen, PromedioPromocion, Diploma
+    IntentoExamen, CalificacionExamen, PromedioPromocion, Diploma
 )
 
 
@@ -49,7 +49,31 @@ class TemaAdmin(admin.ModelAdmin):
 class MaterialAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'tema', 'fecha_creacion')
     list_filter = ('tema__curso', 'fecha_creacion')
-    search_fields = ('titulo', 'descripcion')
+    search_fields = ('titulo', 'descripcion', 'nombre_original')
+
+
+@admin.register(ArchivoMaterial)
+class ArchivoMaterialAdmin(admin.ModelAdmin):
+    list_display = ('hash_contenido', 'tamano', 'referencias', 'huerfano_desde', 'derivados_procesados', 'fecha_creacion')
+    list_filter = ('huerfano_desde', 'derivados_procesados')
+    search_fields = ('hash_contenido',)
+    readonly_fields = ('hash_contenido', 'tamano', 'referencias', 'huerfano_desde', 'derivados_procesados', 'fecha_creacion')
+
+
+@admin.register(DerivadoArchivo)
+class DerivadoArchivoAdmin(admin.ModelAdmin):
+    list_display = ('archivo', 'variante', 'tamano', 'fecha_creacion')
+    list_filter = ('variante',)
+    search_fields = ('archivo__hash_contenido',)
+    readonly_fields = ('archivo', 'variante', 'tamano', 'fecha_creacion')
+
+
+@admin.register(SubidaMaterial)
+class SubidaMaterialAdmin(admin.ModelAdmin):
+    list_display = ('nombre_original', 'usuario', 'tema', 'recibidos', 'tamano_total', 'estado', 'fecha_actualizacion')
+    list_filter = ('estado', 'fecha_creacion')
+    search_fields = ('nombre_original', 'titulo', 'usuario__username')
+    readonly_fields = ('id', 'sha256', 'recibidos', 'material', 'fecha_creacion', 'fecha_actualizacion')
 
 
 @admin.register(Inscripcion)
@@ -96,6 +120,14 @@ class RecuperacionExamenAdmin(admin.ModelAdmin):
     search_fields = ('inscripcion__alumno__username', 'inscripcion__alumno__first_name')
 
 
+@admin.register(IntentoExamen)
+class IntentoExamenAdmin(admin.ModelAdmin):
+    list_display = ('examen', 'inscripcion', 'recuperacion', 'fecha_creacion')
+    list_filter = ('examen', 'fecha_creacion')
+    search_fields = ('inscripcion__alumno__username', 'inscripcion__alumno__first_name')
+    readonly_fields = ('preguntas_ids', 'fecha_creacion')
+
+
 @admin.register(CalificacionExamen)
 class CalificacionExamenAdmin(admin.ModelAdmin):
     list_display = ('examen', 'inscripcion', 'recuperacion', 'puntaje_obtenido', 'puntaje_total', 'porcentaje', 'aprobado', 'fecha_completado')
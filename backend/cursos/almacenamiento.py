@@ -0,0 +1,77 @@
+"""
+Almacenamiento direccionado por contenido para los archivos de materiales.
+
+Cada archivo se guarda una sola vez como blobs/<2 primeros caracteres>/<sha256>, sin importar
+cuántos materiales lo usen. El hash se calcula mientras se escribe el archivo, sin leerlo dos
+veces. Las referencias se cuentan en ArchivoMaterial (ver señales de Material). Los derivados
+(miniaturas, versiones comprimidas) se guardan en derivados/<2 caracteres>/<sha256>/<variante>.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+PREFIJO_BLOBS = 'blobs'
+
+PREFIJO_DERIVADOS = 'derivados'
+
+NOMBRE_BLOB = re.compile(rf'^{PREFIJO_BLOBS}/[0-9a-f]{{2}}/([0-9a-f]{{64}})$')
+
+
+def hash_de_nombre(nombre):
+    """Hash SHA-256 de un blob a partir de su nombre almacenado; None para archivos anteriores"""
+    match = NOMBRE_BLOB.match(nombre or '')
+    return match.group(1) if match else None
+
+
+def nombre_de_hash(hash_contenido):
+    return f'{PREFIJO_BLOBS}/{hash_contenido[:2]}/{hash_contenido}'
+
+
+def nombre_derivado(hash_contenido, variante):
+    return f'{PREFIJO_DERIVADOS}/{hash_contenido[:2]}/{hash_contenido}/{variante}'
+
+
+@deconstructible
+class AlmacenamientoDeduplicado(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # El nombre final lo decide el contenido en _save; no hace falta buscar uno libre
+        return name
+
+    def _save(self, name, content):
+        directorio_temporal = self.path(os.path.join(PREFIJO_BLOBS, 'tmp'))
+        os.makedirs(directorio_temporal, exist_ok=True)
+
+        sha256 = hashlib.sha256()
+        descriptor, ruta_temporal = tempfile.mkstemp(dir=directorio_temporal)
+        try:
+            with os.fdopen(descriptor, 'wb') as temporal:
+                if hasattr(content, 'seek') and content.seekable():
+                    content.seek(0)
+                for bloque in content.chunks():
+                    sha256.update(bloque)
+                    temporal.write(bloque)
+
+            nombre = nombre_de_hash(sha256.hexdigest())
+            ruta = self.path(nombre)
+            try:
+                # Si ya existe el mismo contenido se renueva la fecha para que la limpieza de
+                # huérfanos no lo borre mientras se registra la nueva referencia
+                os.utime(ruta)
+            except FileNotFoundError:
+                # No existe, o la limpieza lo borró entre tanto: se escribe el temporal
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(ruta_temporal, self.file_permissions_mode)
+                os.replace(ruta_temporal, ruta)
+        finally:
+            if os.path.exists(ruta_temporal):
+                os.remove(ruta_temporal)
+        return nombre
+
+
+almacenamiento_materiales = AlmacenamientoDeduplicado()
@@ -4,6 +4,9 @@ from django.apps import AppConfig
 class CursosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cursos'
-
-
+    
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Registra el system check de la réplica de lectura
+        from elohimcoban import routers  # noqa: F401
 
@@ -0,0 +1,210 @@
+"""
+Derivados de los archivos de materiales, para que los alumnos con datos móviles no descarguen
+el archivo completo solo para verlo:
+
+- miniatura y vista_previa (JPEG) de imágenes y de la primera página de los PDF
+- gzip y br (brotli) de los documentos comprimibles
+
+Se generan una sola vez por contenido (ArchivoMaterial) en un pool de hilos en segundo plano
+(DERIVADOS_TRABAJADORES), después de confirmar la transacción que registró el archivo. El
+comando generar_derivados procesa los pendientes (p. ej. tras reiniciar el servidor).
+La vista previa de PDF requiere pdftoppm (poppler-utils) y brotli el paquete "Brotli"; si no
+están disponibles esas variantes simplemente no se generan.
+"""
+
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mimetypes import guess_type
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from PIL import Image, ImageOps
+
+from .almacenamiento import PREFIJO_DERIVADOS, almacenamiento_materiales, nombre_derivado
+from .models import ArchivoMaterial, DerivadoArchivo, Material
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+TAMANOS_IMAGEN = {'miniatura': 320, 'vista_previa': 1280}
+
+VARIANTES_IMAGEN = tuple(TAMANOS_IMAGEN)
+
+# Orden de preferencia al negociar Accept-Encoding
+CODIFICACIONES = ('br', 'gzip')
+
+TIPOS_COMPRIMIBLES = {
+    'application/json', 'application/xml', 'application/javascript', 'application/rtf',
+    'application/pdf', 'application/x-tex', 'image/svg+xml',
+}
+
+# Un derivado comprimido solo se conserva si ahorra al menos este porcentaje
+AHORRO_MINIMO = 0.1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def es_comprimible(content_type):
+    return bool(content_type) and (content_type.startswith('text/') or content_type in TIPOS_COMPRIMIBLES)
+
+
+def elegir_codificacion(accept_encoding, disponibles):
+    """Primera codificación de CODIFICACIONES que el cliente acepta (q > 0) y que existe como derivado"""
+    aceptadas = {}
+    for parte in (accept_encoding or '').split(','):
+        token, _, parametros = parte.strip().partition(';')
+        calidad = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith('q='):
+            try:
+                calidad = float(parametros[2:])
+            except ValueError:
+                calidad = 0.0
+        if token:
+            aceptadas[token.strip().lower()] = calidad
+    for codificacion in CODIFICACIONES:
+        calidad = aceptadas.get(codificacion, aceptadas.get('*', 0.0))
+        if codificacion in disponibles and calidad > 0:
+            return codificacion
+    return None
+
+
+def escribir_derivado(archivo, variante, ruta_origen):
+    """Mueve el archivo generado a su ubicación final y registra el derivado"""
+    destino = almacenamiento_materiales.path(nombre_derivado(archivo.hash_contenido, variante))
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    os.replace(ruta_origen, destino)
+    try:
+        DerivadoArchivo.objects.update_or_create(
+            archivo=archivo, variante=variante, defaults={'tamano': os.path.getsize(destino)}
+        )
+    except IntegrityError:
+        # Otro trabajador registró la misma variante al mismo tiempo
+        pass
+
+
+def generar_imagenes(archivo, ruta_imagen, tamano_original, directorio, siempre=False):
+    """Miniatura y vista previa en JPEG; salvo `siempre`, se descartan si no son más livianas que el original"""
+    with Image.open(ruta_imagen) as imagen:
+        imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode not in ('RGB', 'L'):
+            imagen = imagen.convert('RGB')
+        for variante, lado in TAMANOS_IMAGEN.items():
+            copia = imagen.copy()
+            copia.thumbnail((lado, lado))
+            ruta = os.path.join(directorio, f'{variante}.jpg')
+            copia.save(ruta, 'JPEG', quality=80, optimize=True, progressive=True)
+            if siempre or os.path.getsize(ruta) < tamano_original:
+                escribir_derivado(archivo, variante, ruta)
+
+
+def renderizar_primera_pagina(ruta_pdf, directorio):
+    """PNG de la primera página del PDF con pdftoppm; None si no está instalado o falla"""
+    pdftoppm = shutil.which('pdftoppm')
+    if not pdftoppm:
+        return None
+    prefijo = os.path.join(directorio, 'pagina')
+    try:
+        subprocess.run(
+            [pdftoppm, '-f', '1', '-l', '1', '-png', '-r', '100', '-singlefile', ruta_pdf, prefijo],
+            check=True, capture_output=True, timeout=60,
+        )
+    except (OSError, subprocess.SubprocessError):
+        logger.warning('No se pudo renderizar la primera página de %s', ruta_pdf)
+        return None
+    return f'{prefijo}.png'
+
+
+def comprimir(archivo, ruta, tamano_original, directorio):
+    """Versiones gzip y brotli, escritas por bloques; solo se conservan si ahorran espacio"""
+    variantes = ['gzip'] + (['br'] if brotli is not None else [])
+    for variante in variantes:
+        ruta_salida = os.path.join(directorio, variante)
+        with open(ruta, 'rb') as origen, open(ruta_salida, 'wb') as destino:
+            if variante == 'gzip':
+                with gzip.GzipFile(fileobj=destino, mode='wb', compresslevel=9, mtime=0) as salida:
+                    shutil.copyfileobj(origen, salida, 1024 * 1024)
+            else:
+                compresor = brotli.Compressor(quality=11)
+                for bloque in iter(lambda: origen.read(1024 * 1024), b''):
+                    destino.write(compresor.process(bloque))
+                destino.write(compresor.finish())
+        if os.path.getsize(ruta_salida) <= tamano_original * (1 - AHORRO_MINIMO):
+            escribir_derivado(archivo, variante, ruta_salida)
+
+
+def generar_derivados(archivo):
+    """Genera todas las variantes aplicables a un ArchivoMaterial y lo marca como procesado"""
+    nombre = archivo.nombre
+    if not almacenamiento_materiales.exists(nombre):
+        return
+    ruta = almacenamiento_materiales.path(nombre)
+    tamano = os.path.getsize(ruta)
+
+    # El blob no tiene extensión: el tipo se deduce del nombre original de un material que lo usa
+    nombre_original = Material.objects.filter(archivo=nombre).values_list('nombre_original', flat=True).first()
+    content_type, _ = guess_type(nombre_original or '')
+
+    # Directorio temporal en el mismo disco que los derivados para moverlos con os.replace
+    raiz = almacenamiento_materiales.path(PREFIJO_DERIVADOS)
+    os.makedirs(raiz, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=raiz) as directorio:
+        if content_type == 'application/pdf':
+            pagina = renderizar_primera_pagina(ruta, directorio)
+            if pagina:
+                generar_imagenes(archivo, pagina, tamano, directorio, siempre=True)
+        elif content_type and content_type.startswith('image/') and content_type != 'image/svg+xml':
+            try:
+                generar_imagenes(archivo, ruta, tamano, directorio)
+            except (OSError, Image.DecompressionBombError):
+                logger.warning('No se pudieron generar miniaturas de %s', nombre)
+
+        if es_comprimible(content_type) and tamano >= 1024:
+            comprimir(archivo, ruta, tamano, directorio)
+
+    ArchivoMaterial.objects.filter(pk=archivo.pk).update(derivados_procesados=True)
+
+
+def procesar(archivo_id):
+    """Genera los derivados de un archivo; los errores van al log y no a quien lo encoló"""
+    try:
+        archivo = ArchivoMaterial.objects.filter(pk=archivo_id).first()
+        if archivo is not None:
+            generar_derivados(archivo)
+    except Exception:
+        logger.exception('Error generando derivados del archivo %s', archivo_id)
+
+
+def procesar_en_pool(archivo_id):
+    """
+    Tarea del pool: ciclo de conexiones como el de una petición. Solo aquí, porque en línea
+    (DERIVADOS_ASINCRONO=False) la conexión es la de quien llama y no debe cerrarse.
+    """
+    close_old_connections()
+    try:
+        procesar(archivo_id)
+    finally:
+        close_old_connections()
+
+
+def encolar(archivo_id):
+    """Envía la generación al pool en segundo plano (o la ejecuta en línea si DERIVADOS_ASINCRONO=False)"""
+    global _pool
+    if not settings.DERIVADOS_ASINCRONO:
+        procesar(archivo_id)
+        return
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.DERIVADOS_TRABAJADORES, thread_name_prefix='derivados')
+    _pool.submit(procesar_en_pool, archivo_id)
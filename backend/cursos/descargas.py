@@ -0,0 +1,177 @@
+"""
+Servido de archivos de materiales con peticiones condicionales (ETag / Last-Modified -> 304)
+y rangos de bytes (Range -> 206), para reanudar descargas y evitar retransmitir archivos
+que el cliente ya tiene.
+
+Según DESCARGAS_SERVIDOR la transferencia la hace el propio worker ("django") o, después de
+verificar permisos en Django, el servidor web frontal: nginx con X-Accel-Redirect ("nginx")
+o Apache con mod_xsendfile ("apache").
+"""
+
+import os
+import re
+from mimetypes import guess_type
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from elohimcoban import metricas
+
+TAMANO_BLOQUE = 64 * 1024
+
+RANGO_BYTES = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+SERVIDORES = ('django', 'nginx', 'apache')
+
+
+def calcular_etag(tamano, mtime_ns, hash_contenido=None):
+    """ETag fuerte: el hash del contenido si se conoce; si no, tamaño y fecha de modificación"""
+    if hash_contenido:
+        return f'"{hash_contenido}"'
+    return f'"{tamano:x}-{mtime_ns:x}"'
+
+
+def parsear_rango(encabezado, tamano):
+    """
+    Interpreta un encabezado Range de un único rango. Retorna (inicio, fin) inclusivos, None si
+    el encabezado no se puede usar (se responde el archivo completo) o False si el rango no es
+    satisfacible. Los rangos múltiples se ignoran, lo cual permite el RFC 9110; también los
+    inválidos (fin menor que inicio), que según el §14.1.1 no se deben responder con 416.
+    """
+    match = RANGO_BYTES.match(encabezado.strip())
+    if not match:
+        return None
+    inicio, fin = match.groups()
+    if not inicio and not fin:
+        return None
+    if not inicio:
+        # Sufijo: los últimos N bytes
+        sufijo = int(fin)
+        if sufijo == 0:
+            return False
+        return max(0, tamano - sufijo), tamano - 1
+    inicio = int(inicio)
+    if fin and int(fin) < inicio:
+        return None
+    if inicio >= tamano:
+        return False
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    return inicio, fin
+
+
+def rango_vigente(request, etag, last_modified):
+    """If-Range: el rango solo aplica si el validador enviado sigue siendo el actual"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    fecha = parse_http_date_safe(if_range)
+    return fecha is not None and fecha == last_modified
+
+
+def leer_rango(ruta, inicio, longitud):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        restante = longitud
+        while restante > 0:
+            bloque = archivo.read(min(TAMANO_BLOQUE, restante))
+            if not bloque:
+                break
+            restante -= len(bloque)
+            yield bloque
+
+
+def content_disposition(nombre):
+    # Ambos formatos para máxima compatibilidad (RFC 5987 para caracteres especiales)
+    return f'attachment; filename="{nombre}"; filename*=UTF-8\'\'{quote(nombre, safe="")}'
+
+
+def delegar_al_servidor_web(ruta, nombre, content_type):
+    """
+    Respuesta vacía que indica al servidor web frontal qué archivo enviar. Retorna None si el
+    servidor configurado es "django" o si el archivo está fuera de MEDIA_ROOT.
+    """
+    servidor = settings.DESCARGAS_SERVIDOR
+    if servidor not in SERVIDORES:
+        raise ImproperlyConfigured(f'DESCARGAS_SERVIDOR debe ser uno de {", ".join(SERVIDORES)}')
+    if servidor == 'django':
+        return None
+
+    ruta = os.path.abspath(ruta)
+    relativa = os.path.relpath(ruta, os.path.abspath(settings.MEDIA_ROOT))
+    if relativa.startswith(os.pardir):
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    response['Content-Disposition'] = content_disposition(nombre)
+    if servidor == 'nginx':
+        # nginx atiende Range e If-Range sobre la location interna
+        prefijo = settings.DESCARGAS_PREFIJO_INTERNO.rstrip('/')
+        response['X-Accel-Redirect'] = quote(f'{prefijo}/{relativa.replace(os.sep, "/")}')
+    else:
+        response['X-Sendfile'] = ruta
+    return response
+
+
+def servir_archivo(request, ruta, nombre, hash_contenido=None, content_encoding=None):
+    """
+    Respuesta de descarga para el archivo en `ruta` con validadores y soporte de rangos.
+    Con `content_encoding` el archivo es una versión comprimida (gzip, br) de `nombre`.
+    """
+    estado_archivo = os.stat(ruta)
+    tamano = estado_archivo.st_size
+    last_modified = int(estado_archivo.st_mtime)
+    etag = calcular_etag(tamano, estado_archivo.st_mtime_ns, hash_contenido)
+
+    content_type, _ = guess_type(nombre)
+    content_type = content_type or 'application/octet-stream'
+
+    def encabezados(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        # La representación elegida depende de Accept-Encoding (versiones comprimidas)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        # Materiales protegidos por permisos: solo caché privada y siempre revalidando
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    # 304 Not Modified / 412 Precondition Failed según If-None-Match, If-Modified-Since, etc.
+    condicional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if condicional is not None:
+        return encabezados(condicional)
+
+    # nginx no reenvía Content-Encoding en X-Accel-Redirect: las versiones comprimidas (más
+    # livianas) se sirven siempre desde Django
+    delegada = None if content_encoding else delegar_al_servidor_web(ruta, nombre, content_type)
+    if delegada is not None:
+        metricas.DESCARGA_BYTES.inc(tamano)
+        return encabezados(delegada)
+
+    inicio, fin = 0, tamano - 1
+    rango = None
+    if request.META.get('HTTP_RANGE') and tamano > 0 and rango_vigente(request, etag, last_modified):
+        rango = parsear_rango(request.META['HTTP_RANGE'], tamano)
+        if rango is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{tamano}'
+            return encabezados(response)
+        if rango:
+            inicio, fin = rango
+
+    longitud = fin - inicio + 1 if tamano else 0
+    response = StreamingHttpResponse(leer_rango(ruta, inicio, longitud), content_type=content_type)
+    response['Content-Length'] = str(longitud)
+    response['Content-Disposition'] = content_disposition(nombre)
+    if rango:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+    metricas.DESCARGA_BYTES.inc(longitud)
+    return encabezados(response)
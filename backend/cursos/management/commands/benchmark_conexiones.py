@@ -0,0 +1,91 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from usuarios.models import Usuario
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara la latencia de un endpoint barato (/api/auth/profile/) abriendo una conexión '
+        'por petición (CONN_MAX_AGE=0) contra conexiones persistentes con y sin health checks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=200)
+        parser.add_argument('--url', default='/api/auth/profile/')
+        parser.add_argument('--usuario', help='Username con el que se autentican las peticiones (por defecto el primero)')
+
+    def medir(self, cliente, url, iteraciones, conn_max_age, health_checks):
+        """
+        Repite la petición emulando el ciclo de vida de Django: close_old_connections() al iniciar
+        y al terminar cada petición, que es lo que decide si la conexión se cierra o se reutiliza.
+        """
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        connection.settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+        conexiones_antes = self.conexiones_abiertas
+        tiempos = []
+        for _ in range(iteraciones):
+            inicio = time.perf_counter()
+            close_old_connections()
+            respuesta = cliente.get(url)
+            close_old_connections()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            if respuesta.status_code != 200:
+                raise CommandError(f'{url} respondió {respuesta.status_code}')
+        connection.close()
+        tiempos.sort()
+        return {
+            'p50_ms': statistics.median(tiempos),
+            'p95_ms': tiempos[max(0, int(len(tiempos) * 0.95) - 1)],
+            'conexiones': self.conexiones_abiertas - conexiones_antes,
+        }
+
+    def handle(self, *args, **options):
+        usuarios = Usuario.objects.order_by('id')
+        if options['usuario']:
+            usuarios = usuarios.filter(username=options['usuario'])
+        usuario = usuarios.first()
+        if usuario is None:
+            raise CommandError('No hay usuarios para autenticar las peticiones')
+
+        cliente = APIClient(HTTP_HOST='localhost')
+        cliente.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(usuario)}')
+
+        # Contar conexiones reales abiertas envolviendo connect()
+        self.conexiones_abiertas = 0
+        connect_original = connection.connect
+
+        def connect():
+            self.conexiones_abiertas += 1
+            connect_original()
+
+        connection.connect = connect
+        configuracion = dict(connection.settings_dict)
+        try:
+            modos = [
+                ('Conexión por petición (CONN_MAX_AGE=0)', 0, False),
+                ('Persistente (CONN_MAX_AGE=60)', 60, False),
+                ('Persistente + health checks', 60, True),
+            ]
+            resultados = []
+            for nombre, conn_max_age, health_checks in modos:
+                resultado = self.medir(cliente, options['url'], options['iteraciones'], conn_max_age, health_checks)
+                resultados.append(resultado)
+                self.stdout.write(
+                    f'{nombre:<42} p50 {resultado["p50_ms"]:>8.2f} ms  p95 {resultado["p95_ms"]:>8.2f} ms  '
+                    f'{resultado["conexiones"]:>5} conexiones'
+                )
+        finally:
+            connection.connect = connect_original
+            connection.settings_dict.update(configuracion)
+
+        ahorro = resultados[0]['p50_ms'] - resultados[2]['p50_ms']
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Reutilizar conexiones ahorra {ahorro:.2f} ms por petición (p50) en {connection.vendor}'
+        ))
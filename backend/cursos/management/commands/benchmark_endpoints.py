@@ -0,0 +1,244 @@
+import gc
+import json
+import math
+import platform
+import statistics
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from cursos.models import (
+    Promocion, Inscripcion, Asistencia, Examen, CalificacionExamen, RespuestaExamen, IntentoExamen
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide latencia (p50/p95) y cantidad de consultas SQL de los endpoints principales usando '
+        'el cliente de pruebas sobre el dataset cargado, y falla si se superan los presupuestos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=20)
+        parser.add_argument('--calentamiento', type=int, default=2, help='Iteraciones descartadas al inicio')
+        parser.add_argument(
+            '--presupuestos', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'presupuestos.json'),
+            help='Archivo JSON con los presupuestos por endpoint'
+        )
+        parser.add_argument(
+            '--tolerancia', type=float, default=0.25,
+            help='Margen permitido sobre el presupuesto de latencia (0.25 = 25%%)'
+        )
+        parser.add_argument(
+            '--margen-ms', type=float, default=5.0,
+            help='Margen absoluto mínimo de latencia, para endpoints de pocos milisegundos'
+        )
+        parser.add_argument('--reporte', help='Ruta donde escribir el reporte JSON de esta ejecución')
+        parser.add_argument(
+            '--actualizar-presupuestos', action='store_true',
+            help='Guardar los resultados de esta ejecución como nuevos presupuestos'
+        )
+        parser.add_argument(
+            '--holgura', type=float, default=0.5,
+            help='Holgura agregada al p95 medido al guardar presupuestos (0.5 = 50%%)'
+        )
+        parser.add_argument('--solo', nargs='*', help='Nombres de los escenarios a ejecutar')
+
+    # Escenarios
+
+    def preparar_datos(self):
+        """Elige del dataset una promoción grande, un alumno con un examen pendiente y su docente"""
+        promocion = Promocion.objects.filter(docente__isnull=False).order_by('-id').first()
+        if promocion is None:
+            raise CommandError('No hay datos: carga un dataset con "python manage.py seed_scale"')
+        for inscripcion in Inscripcion.objects.filter(promocion=promocion, activa=True).select_related('alumno')[:200]:
+            examen = Examen.objects.filter(tema__curso_id=promocion.curso_id, activo=True).exclude(
+                calificaciones__inscripcion=inscripcion, calificaciones__recuperacion__isnull=True
+            ).first()
+            if examen is not None:
+                break
+        else:
+            raise CommandError('No se encontró un alumno con exámenes pendientes en el dataset')
+
+        tema_id = Asistencia.objects.filter(inscripcion__promocion=promocion).values_list('tema_id', flat=True).first()
+        return {
+            'promocion': promocion,
+            'docente': promocion.docente,
+            'alumno': inscripcion.alumno,
+            'examen': examen,
+            'tema_id': tema_id,
+        }
+
+    def escenarios(self, datos):
+        """
+        Cada escenario es (usuario, preparar). `preparar` recibe el cliente, hace la preparación
+        que no debe medirse y retorna la función que ejecuta la petición medida.
+        """
+        promocion, examen = datos['promocion'], datos['examen']
+        alumno, docente = datos['alumno'], datos['docente']
+
+        def responder(cliente):
+            # Las preguntas del intento se cargan fuera de la medición (preparación)
+            ids = [p['id'] for p in cliente.get(f'/api/examenes/{examen.id}/preguntas/').data['preguntas']]
+            cuerpo = {'respuestas': [{'pregunta_id': pregunta_id, 'respuesta': 'a'} for pregunta_id in ids]}
+            return lambda: cliente.post(f'/api/examenes/{examen.id}/responder/', cuerpo, format='json')
+
+        def get(url):
+            return lambda cliente: (lambda: cliente.get(url))
+
+        def post(url, cuerpo):
+            return lambda cliente: (lambda: cliente.post(url, cuerpo, format='json'))
+
+        return {
+            'examenes_lista': (alumno, get('/api/examenes/')),
+            'examenes_preguntas': (alumno, get(f'/api/examenes/{examen.id}/preguntas/')),
+            'examenes_responder': (alumno, responder),
+            'calcular_promedios': (docente, post('/api/promedios/calcular_promedios/', {'promocion_id': promocion.id})),
+            'generar_diplomas': (docente, post('/api/diplomas/generar_diplomas/', {'promocion_id': promocion.id})),
+            'asistencias_lista': (docente, get(f'/api/asistencias/?tema={datos["tema_id"]}')),
+            'asistencias_matriz': (docente, get(f'/api/asistencias/matriz/?promocion={promocion.id}')),
+            'calificaciones_lista': (docente, get('/api/calificaciones/')),
+            'calificaciones_lista_cursor': (docente, get('/api/calificaciones/?paginacion=cursor')),
+            'promedios_lista': (docente, get(f'/api/promedios/?promocion={promocion.id}')),
+        }
+
+    # Medición
+
+    def medir(self, usuario, preparar, iteraciones, calentamiento):
+        """Ejecuta el escenario dentro de transacciones revertidas para no alterar el dataset"""
+        tiempos, consultas, estados = [], [], set()
+        for i in range(calentamiento + iteraciones):
+            cliente = APIClient(HTTP_HOST='localhost')
+            cliente.force_authenticate(user=usuario)
+            with transaction.atomic():
+                peticion = preparar(cliente)
+                # Evita que una recolección pendiente de iteraciones previas caiga dentro de la medición
+                gc.collect()
+                with CaptureQueriesContext(connection) as capturadas:
+                    inicio = time.perf_counter()
+                    respuesta = peticion()
+                    if getattr(respuesta, 'streaming', False):
+                        b''.join(respuesta.streaming_content)
+                    duracion = (time.perf_counter() - inicio) * 1000
+                transaction.set_rollback(True)
+            if i >= calentamiento:
+                tiempos.append(duracion)
+                # Los savepoints solo aparecen porque la medición corre dentro de una transacción
+                consultas.append(sum(
+                    1 for consulta in capturadas.captured_queries
+                    if not consulta['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'))
+                ))
+                estados.add(respuesta.status_code)
+        return {
+            'p50_ms': round(statistics.median(tiempos), 2),
+            'p95_ms': round(self.percentil(tiempos, 95), 2),
+            'consultas': max(consultas),
+            'estados': sorted(estados),
+        }
+
+    @staticmethod
+    def percentil(valores, p):
+        ordenados = sorted(valores)
+        indice = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+        return ordenados[indice]
+
+    def handle(self, *args, **options):
+        ruta_presupuestos = Path(options['presupuestos'])
+        presupuestos = {}
+        if ruta_presupuestos.exists():
+            archivo = json.loads(ruta_presupuestos.read_text(encoding='utf-8'))
+            presupuestos = archivo.get('endpoints', {})
+            base_presupuestos = archivo.get('base_de_datos')
+            if base_presupuestos and base_presupuestos != connection.vendor:
+                # Latencias y planes de otro motor no dicen nada de este: no se comparan ni se mezclan
+                if not options['actualizar_presupuestos']:
+                    raise CommandError(
+                        f'Los presupuestos de {ruta_presupuestos} se midieron con {base_presupuestos} y la base '
+                        f'actual es {connection.vendor}. Ejecutar contra {base_presupuestos} o indicar otro '
+                        f'archivo con --presupuestos'
+                    )
+                self.stdout.write(self.style.WARNING(
+                    f'○ Se reemplazan los presupuestos de {base_presupuestos} por mediciones de {connection.vendor}'
+                ))
+                presupuestos = {}
+
+        datos = self.preparar_datos()
+        escenarios = self.escenarios(datos)
+        if options['solo']:
+            escenarios = {nombre: escenarios[nombre] for nombre in options['solo']}
+
+        resultados, regresiones = {}, []
+        for nombre, (usuario, preparar) in escenarios.items():
+            resultado = self.medir(usuario, preparar, options['iteraciones'], options['calentamiento'])
+            resultados[nombre] = resultado
+
+            problemas = []
+            if any(estado >= 400 for estado in resultado['estados']):
+                problemas.append(f'respuesta HTTP {resultado["estados"]}')
+            presupuesto = presupuestos.get(nombre)
+            if presupuesto and not options['actualizar_presupuestos']:
+                if resultado['consultas'] > presupuesto['consultas']:
+                    problemas.append(f'{resultado["consultas"]} consultas (presupuesto {presupuesto["consultas"]})')
+                limite = max(
+                    presupuesto['p95_ms'] * (1 + options['tolerancia']),
+                    presupuesto['p95_ms'] + options['margen_ms'],
+                )
+                if resultado['p95_ms'] > limite:
+                    problemas.append(f'p95 {resultado["p95_ms"]} ms (presupuesto {presupuesto["p95_ms"]} ms)')
+
+            linea = f'{nombre:<30} p50 {resultado["p50_ms"]:>9.2f} ms  p95 {resultado["p95_ms"]:>9.2f} ms  {resultado["consultas"]:>4} consultas'
+            if problemas:
+                regresiones.append({'endpoint': nombre, 'problemas': problemas})
+                self.stdout.write(self.style.ERROR(f'✗ {linea}  <- {"; ".join(problemas)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'✓ {linea}'))
+
+        reporte = {
+            'fecha': timezone.now().isoformat(),
+            'entorno': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'base_de_datos': connection.vendor,
+            },
+            'dataset': {
+                'inscripciones': Inscripcion.objects.count(),
+                'calificaciones': CalificacionExamen.objects.count(),
+                'respuestas': RespuestaExamen.objects.count(),
+                'intentos': IntentoExamen.objects.count(),
+                'asistencias': Asistencia.objects.count(),
+            },
+            'parametros': {k: options[k] for k in ('iteraciones', 'calentamiento', 'tolerancia', 'margen_ms')},
+            'endpoints': resultados,
+            'regresiones': regresiones,
+        }
+        if options['reporte']:
+            Path(options['reporte']).write_text(json.dumps(reporte, indent=2, ensure_ascii=False), encoding='utf-8')
+            self.stdout.write(f'Reporte escrito en {options["reporte"]}')
+
+        if options['actualizar_presupuestos']:
+            ruta_presupuestos.parent.mkdir(parents=True, exist_ok=True)
+            nuevos = {
+                nombre: {
+                    'consultas': r['consultas'],
+                    'p95_ms': math.ceil(r['p95_ms'] * (1 + options['holgura'])),
+                }
+                for nombre, r in resultados.items()
+            }
+            contenido = {
+                'dataset': reporte['dataset'],
+                'base_de_datos': connection.vendor,
+                'endpoints': {**presupuestos, **nuevos},
+            }
+            ruta_presupuestos.write_text(json.dumps(contenido, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f'✓ Presupuestos actualizados en {ruta_presupuestos}'))
+            return
+
+        if regresiones:
+            raise CommandError(f'{len(regresiones)} endpoint(s) fuera de presupuesto')
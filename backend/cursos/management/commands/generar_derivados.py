@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from cursos.derivados import generar_derivados
+from cursos.models import ArchivoMaterial
+
+TAMANO_LOTE = 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera miniaturas, vistas previas y versiones comprimidas de los archivos de materiales '
+        'pendientes (p. ej. los subidos antes de esta función o si el servidor se reinició)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos', action='store_true',
+            help='Regenerar los derivados de todos los archivos, no solo los pendientes'
+        )
+
+    def handle(self, *args, **options):
+        archivos = ArchivoMaterial.objects.filter(referencias__gt=0)
+        if not options['todos']:
+            archivos = archivos.filter(derivados_procesados=False)
+
+        # Lotes por pk en lugar de .iterator(): sin cursores del servidor (que no funcionan fuera de
+        # una transacción detrás de un pooler en modo transacción) y sin una transacción abierta
+        # mientras se procesan imágenes
+        procesados = 0
+        ultimo_id = 0
+        while True:
+            lote = list(archivos.filter(pk__gt=ultimo_id).order_by('pk')[:TAMANO_LOTE])
+            if not lote:
+                break
+            for archivo in lote:
+                try:
+                    generar_derivados(archivo)
+                except Exception as error:
+                    self.stdout.write(self.style.WARNING(f'○ {archivo.hash_contenido}: {error}'))
+                    continue
+                procesados += 1
+            ultimo_id = lote[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'✓ {procesados} archivo(s) procesados'))
@@ -0,0 +1,119 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from cursos.almacenamiento import PREFIJO_BLOBS, almacenamiento_materiales, hash_de_nombre
+from cursos.models import ArchivoMaterial, Material, SubidaMaterial
+
+
+class Command(BaseCommand):
+    help = (
+        'Mantenimiento del almacenamiento deduplicado de materiales: recuenta referencias, borra '
+        'blobs huérfanos, descarta subidas reanudables vencidas y, opcionalmente, migra los '
+        'archivos anteriores a blobs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gracia', type=int, default=settings.MATERIALES_GRACIA_HUERFANOS,
+            help='Segundos mínimos desde la última escritura de un blob antes de borrarlo'
+        )
+        parser.add_argument(
+            '--migrar', action='store_true',
+            help='Mover los archivos guardados en materiales/ al almacenamiento deduplicado'
+        )
+
+    def migrar_existentes(self):
+        """Guarda como blob cada archivo anterior y borra el original cuando ya nadie lo usa"""
+        migrados = 0
+        for material in Material.objects.exclude(archivo__startswith=f'{PREFIJO_BLOBS}/').exclude(archivo=''):
+            anterior = material.archivo.name
+            if not almacenamiento_materiales.exists(anterior):
+                self.stdout.write(self.style.WARNING(f'○ Material {material.id}: no existe {anterior}'))
+                continue
+            with almacenamiento_materiales.open(anterior) as contenido:
+                material.archivo.name = almacenamiento_materiales.save(anterior, File(contenido))
+            material.save(update_fields=['archivo'])
+            if not Material.objects.filter(archivo=anterior).exists():
+                almacenamiento_materiales.delete(anterior)
+            migrados += 1
+        self.stdout.write(self.style.SUCCESS(f'✓ {migrados} archivo(s) migrados al almacenamiento deduplicado'))
+
+    def recontar(self):
+        """Corrige el conteo de referencias a partir de los materiales existentes"""
+        usados = dict(
+            Material.objects.filter(archivo__startswith=f'{PREFIJO_BLOBS}/')
+            .values_list('archivo').annotate(total=Count('id'))
+        )
+        for nombre in usados:
+            if not ArchivoMaterial.objects.filter(hash_contenido=hash_de_nombre(nombre)).exists():
+                ArchivoMaterial.objects.create(
+                    hash_contenido=hash_de_nombre(nombre),
+                    tamano=almacenamiento_materiales.size(nombre) if almacenamiento_materiales.exists(nombre) else 0,
+                )
+
+        corregidos = 0
+        for archivo in ArchivoMaterial.objects.all():
+            referencias = usados.get(archivo.nombre, 0)
+            if archivo.referencias != referencias:
+                archivo.referencias = referencias
+                if referencias:
+                    archivo.huerfano_desde = None
+                archivo.save(update_fields=['referencias', 'huerfano_desde'])
+                corregidos += 1
+        ArchivoMaterial.objects.filter(referencias=0, huerfano_desde__isnull=True).update(huerfano_desde=timezone.now())
+        self.stdout.write(self.style.SUCCESS(f'✓ {corregidos} conteo(s) de referencias corregidos'))
+
+    def borrar_sin_registro(self, gracia):
+        """Borra archivos bajo blobs/ que no tienen fila en ArchivoMaterial (p. ej. subidas interrumpidas)"""
+        raiz = almacenamiento_materiales.path(PREFIJO_BLOBS)
+        if not os.path.isdir(raiz):
+            return 0
+        conocidos = set(ArchivoMaterial.objects.values_list('hash_contenido', flat=True))
+        limite = time.time() - gracia
+        borrados = 0
+        for directorio, _, archivos in os.walk(raiz):
+            for nombre in archivos:
+                ruta = os.path.join(directorio, nombre)
+                if nombre in conocidos or os.path.getmtime(ruta) > limite:
+                    continue
+                os.remove(ruta)
+                borrados += 1
+        return borrados
+
+    def descartar_subidas_vencidas(self):
+        """
+        Elimina las subidas sin finalizar inactivas por más de SUBIDAS_EXPIRACION_HORAS y sus
+        archivos parciales (también las que quedaron en 'finalizando' si el proceso se interrumpió)
+        """
+        limite = timezone.now() - timedelta(hours=settings.SUBIDAS_EXPIRACION_HORAS)
+        vencidas = SubidaMaterial.objects.filter(
+            estado__in=['pendiente', 'finalizando'], fecha_actualizacion__lt=limite
+        )
+        descartadas = 0
+        for subida in vencidas:
+            subida.eliminar_temporal()
+            subida.delete()
+            descartadas += 1
+        return descartadas
+
+    def handle(self, *args, **options):
+        if options['migrar']:
+            self.migrar_existentes()
+
+        self.recontar()
+
+        eliminados = ArchivoMaterial.limpiar_huerfanos(gracia=options['gracia'])
+        self.stdout.write(self.style.SUCCESS(f'✓ {eliminados} blob(s) huérfanos eliminados'))
+
+        sin_registro = self.borrar_sin_registro(options['gracia'])
+        self.stdout.write(self.style.SUCCESS(f'✓ {sin_registro} archivo(s) sin registro eliminados'))
+
+        descartadas = self.descartar_subidas_vencidas()
+        self.stdout.write(self.style.SUCCESS(f'✓ {descartadas} subida(s) vencidas descartadas'))
@@ -0,0 +1,216 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from usuarios.models import Usuario
+from cursos.models import (
+    Curso, Promocion, Tema, Inscripcion, Asistencia, Pregunta, Examen, RespuestaExamen,
+    RecuperacionExamen, IntentoExamen, CalificacionExamen, PromedioPromocion
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera un dataset sintético de tamaño configurable para pruebas de carga y escala. '
+        'Es determinista a partir de la semilla'
+    )
+
+    TIPOS_ASISTENCIA = ['presente', 'tarde', 'presente_sin_camara', 'no_asistio']
+    PESOS_ASISTENCIA = [70, 12, 8, 10]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semilla', type=int, default=42, help='Semilla del generador aleatorio')
+        parser.add_argument('--cursos', type=int, default=3)
+        parser.add_argument('--promociones', type=int, default=4, help='Promociones por curso')
+        parser.add_argument('--temas', type=int, default=12, help='Temas por curso')
+        parser.add_argument('--preguntas', type=int, default=200, help='Preguntas por tema')
+        parser.add_argument('--preguntas-examen', type=int, default=10, help='Preguntas por examen')
+        parser.add_argument('--alumnos', type=int, default=20000)
+        parser.add_argument(
+            '--examenes-respondidos', type=float, default=0.9,
+            help='Proporción de exámenes que cada alumno ya respondió'
+        )
+        parser.add_argument(
+            '--recuperaciones', type=float, default=0.3,
+            help='Proporción de exámenes reprobados con recuperación'
+        )
+        parser.add_argument('--lote', type=int, default=1000, help='Tamaño de lote para bulk_create')
+        parser.add_argument('--prefijo', default='seed', help='Prefijo de usuarios y cursos generados')
+        parser.add_argument(
+            '--limpiar', action='store_true',
+            help='Eliminar antes los datos generados con el mismo prefijo'
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['semilla'])
+        self.lote = options['lote']
+        prefijo = options['prefijo']
+        inicio = time.perf_counter()
+
+        if options['limpiar']:
+            self.limpiar(prefijo)
+        elif Usuario.objects.filter(username__startswith=f'{prefijo}_').exists():
+            raise CommandError(f'Ya existen datos con el prefijo "{prefijo}". Usa --limpiar o cambia --prefijo')
+
+        password = make_password(prefijo)
+        hoy = date.today()
+
+        with transaction.atomic():
+            docentes = Usuario.objects.bulk_create([
+                Usuario(username=f'{prefijo}_docente_{i}', first_name='Docente', last_name=str(i),
+                        tipo='docente', password=password)
+                for i in range(options['cursos'])
+            ])
+            cursos = Curso.objects.bulk_create([
+                Curso(nombre=f'{prefijo} Curso {i}', descripcion='Curso generado para pruebas de escala')
+                for i in range(options['cursos'])
+            ])
+            promociones = Promocion.objects.bulk_create([
+                Promocion(curso=curso, docente=docente, nombre=f'Promoción {j}',
+                          fecha_inicio=hoy - timedelta(days=30 * (options['promociones'] - j)))
+                for curso, docente in zip(cursos, docentes)
+                for j in range(options['promociones'])
+            ])
+            temas = Tema.objects.bulk_create([
+                Tema(curso=curso, numero_tema=n + 1, titulo=f'Tema {n + 1}',
+                     fecha_clase=hoy - timedelta(days=7 * (options['temas'] - n)))
+                for curso in cursos
+                for n in range(options['temas'])
+            ])
+        self.stdout.write(f'  {len(cursos)} cursos, {len(promociones)} promociones, {len(temas)} temas')
+
+        # Banco de preguntas y exámenes
+        total_preguntas = 0
+        preguntas_por_tema = {}
+        for tema in temas:
+            preguntas = Pregunta.objects.bulk_create([
+                Pregunta(tema=tema, pregunta_texto=f'Pregunta {n + 1} del {tema.titulo}',
+                         tipo_pregunta='opcion_multiple', opcion_a='A', opcion_b='B', opcion_c='C', opcion_d='D',
+                         respuesta_correcta=self.rng.choice('abcd'))
+                for n in range(options['preguntas'])
+            ], batch_size=self.lote)
+            preguntas_por_tema[tema.id] = [(p.id, p.respuesta_correcta) for p in preguntas]
+            total_preguntas += len(preguntas)
+        examenes = Examen.objects.bulk_create([
+            Examen(tema=tema, titulo=f'Examen {tema.titulo}',
+                   numero_preguntas=min(options['preguntas_examen'], options['preguntas']))
+            for tema in temas
+        ])
+        self.stdout.write(f'  {total_preguntas} preguntas, {len(examenes)} exámenes')
+
+        # Alumnos e inscripciones
+        alumnos = []
+        for inicio_lote in range(0, options['alumnos'], self.lote):
+            alumnos += Usuario.objects.bulk_create([
+                Usuario(username=f'{prefijo}_alumno_{i}', first_name='Alumno', last_name=str(i),
+                        tipo='alumno', password=password)
+                for i in range(inicio_lote, min(inicio_lote + self.lote, options['alumnos']))
+            ])
+        inscripciones = Inscripcion.objects.bulk_create([
+            Inscripcion(alumno=alumno, promocion=self.rng.choice(promociones))
+            for alumno in alumnos
+        ], batch_size=self.lote)
+        self.stdout.write(f'  {len(alumnos)} alumnos inscritos')
+
+        # Asistencias, respuestas, calificaciones y recuperaciones, por lotes de inscripciones
+        temas_por_curso = {}
+        for tema in temas:
+            temas_por_curso.setdefault(tema.curso_id, []).append(tema)
+        examen_por_tema = {examen.tema_id: examen for examen in examenes}
+        curso_por_promocion = {promocion.id: promocion.curso_id for promocion in promociones}
+
+        totales = {'asistencias': 0, 'respuestas': 0, 'calificaciones': 0, 'recuperaciones': 0}
+        for inicio_lote in range(0, len(inscripciones), self.lote):
+            lote = inscripciones[inicio_lote:inicio_lote + self.lote]
+            with transaction.atomic():
+                for clave, cantidad in self.generar_lote(
+                    lote, temas_por_curso, examen_por_tema, curso_por_promocion, preguntas_por_tema, options
+                ).items():
+                    totales[clave] += cantidad
+            self.stdout.write(f'  {min(inicio_lote + self.lote, len(inscripciones))}/{len(inscripciones)} inscripciones', ending='\r')
+        self.stdout.write('')
+        self.stdout.write('  ' + ', '.join(f'{cantidad} {clave}' for clave, cantidad in totales.items()))
+
+        for promocion in promociones:
+            PromedioPromocion.recalcular_promedios(Inscripcion.objects.filter(promocion=promocion, activa=True))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\n✓ Dataset generado en {time.perf_counter() - inicio:.1f}s (semilla {options["semilla"]})'
+        ))
+
+    def generar_lote(self, inscripciones, temas_por_curso, examen_por_tema, curso_por_promocion, preguntas_por_tema, options):
+        """Genera y guarda los datos de un lote de inscripciones"""
+        ahora = timezone.now()
+        asistencias, intentos, recuperaciones, pendientes = [], [], [], []
+
+        for inscripcion in inscripciones:
+            for tema in temas_por_curso[curso_por_promocion[inscripcion.promocion_id]]:
+                asistencias.append(Asistencia(
+                    inscripcion=inscripcion, tema=tema,
+                    tipo_asistencia=self.rng.choices(self.TIPOS_ASISTENCIA, self.PESOS_ASISTENCIA)[0],
+                ))
+                if self.rng.random() >= options['examenes_respondidos']:
+                    continue
+
+                examen = examen_por_tema[tema.id]
+                # Habilidad del alumno en este tema: probabilidad de acertar cada pregunta
+                habilidad = self.rng.uniform(0.4, 1.0)
+                pendientes.append((examen, inscripcion, None, habilidad))
+                if self.rng.random() < options['recuperaciones'] and habilidad < 0.8:
+                    recuperacion = RecuperacionExamen(
+                        examen=examen, inscripcion=inscripcion, completada=True,
+                        fecha_inicio=ahora - timedelta(days=2), fecha_fin=ahora - timedelta(days=1),
+                    )
+                    recuperaciones.append(recuperacion)
+                    pendientes.append((examen, inscripcion, recuperacion, min(habilidad + 0.2, 1.0)))
+
+        Asistencia.objects.bulk_create(asistencias, batch_size=self.lote)
+        RecuperacionExamen.objects.bulk_create(recuperaciones, batch_size=self.lote)
+
+        respuestas, calificaciones = [], []
+        for examen, inscripcion, recuperacion, habilidad in pendientes:
+            sorteo = self.rng.sample(preguntas_por_tema[examen.tema_id], examen.numero_preguntas)
+            intentos.append(IntentoExamen(
+                examen=examen, inscripcion=inscripcion, recuperacion=recuperacion,
+                preguntas_ids=[pregunta_id for pregunta_id, _ in sorteo],
+            ))
+            puntos = Decimal(0)
+            for pregunta_id, correcta in sorteo:
+                es_correcta = self.rng.random() < habilidad
+                respuesta = correcta if es_correcta else self.rng.choice([o for o in 'abcd' if o != correcta])
+                puntos_obtenidos = Decimal(examen.puntos_por_pregunta) if es_correcta else Decimal(0)
+                puntos += puntos_obtenidos
+                respuestas.append(RespuestaExamen(
+                    examen=examen, inscripcion=inscripcion, pregunta_id=pregunta_id, recuperacion=recuperacion,
+                    respuesta_dada=respuesta, es_correcta=es_correcta, puntos_obtenidos=puntos_obtenidos,
+                ))
+            puntaje_total = Decimal(examen.puntaje_total)
+            calificaciones.append(CalificacionExamen(
+                examen=examen, inscripcion=inscripcion, recuperacion=recuperacion,
+                puntaje_obtenido=puntos, puntaje_total=puntaje_total,
+                porcentaje=(puntos / puntaje_total * 100).quantize(Decimal('0.01')),
+            ))
+
+        IntentoExamen.objects.bulk_create(intentos, batch_size=self.lote)
+        RespuestaExamen.objects.bulk_create(respuestas, batch_size=self.lote)
+        CalificacionExamen.objects.bulk_create(calificaciones, batch_size=self.lote)
+
+        return {
+            'asistencias': len(asistencias),
+            'respuestas': len(respuestas),
+            'calificaciones': len(calificaciones),
+            'recuperaciones': len(recuperaciones),
+        }
+
+    def limpiar(self, prefijo):
+        """Elimina los cursos y usuarios generados con el prefijo dado"""
+        with transaction.atomic():
+            cursos, _ = Curso.objects.filter(nombre__startswith=f'{prefijo} Curso ').delete()
+            usuarios, _ = Usuario.objects.filter(username__startswith=f'{prefijo}_').delete()
+        self.stdout.write(self.style.WARNING(f'○ Datos anteriores eliminados ({cursos + usuarios} filas)'))
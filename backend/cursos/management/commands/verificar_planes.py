@@ -0,0 +1,85 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from cursos.models import (
+    Inscripcion, Asistencia, Examen, RespuestaExamen, CalificacionExamen, PromedioPromocion
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta EXPLAIN sobre las consultas principales de la API y falla si aparece un '
+        'Seq Scan sobre una tabla grande (usar sobre un dataset de tamaño realista)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filas-minimas', type=int, default=10000,
+            help='Solo se reportan Seq Scan sobre tablas con al menos esta cantidad de filas estimadas'
+        )
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Usar EXPLAIN ANALYZE (ejecuta las consultas)'
+        )
+
+    def consultas(self):
+        """Consultas representativas de los endpoints principales, con parámetros tomados de los datos"""
+        calificacion = CalificacionExamen.objects.order_by('-id').first()
+        asistencia = Asistencia.objects.order_by('-id').first()
+        inscripcion = Inscripcion.objects.order_by('-id').first()
+        if not (calificacion and asistencia and inscripcion):
+            raise CommandError('No hay datos suficientes: carga primero un dataset de tamaño realista')
+        ahora = timezone.now()
+
+        return {
+            'responder: calificación normal existente': CalificacionExamen.objects.filter(
+                examen_id=calificacion.examen_id, inscripcion_id=calificacion.inscripcion_id, recuperacion__isnull=True
+            ),
+            'responder: respuestas del intento': RespuestaExamen.objects.filter(
+                examen_id=calificacion.examen_id, inscripcion_id=calificacion.inscripcion_id, recuperacion__isnull=True
+            ),
+            'asistencias?tema=': Asistencia.objects.filter(tema_id=asistencia.tema_id),
+            'alcance del alumno (inscripciones activas)': Inscripcion.objects.filter(
+                alumno_id=inscripcion.alumno_id, activa=True
+            ).values_list('promocion_id', 'promocion__curso_id'),
+            'exámenes disponibles': Examen.objects.filter(activo=True).filter(
+                Q(fecha_inicio__isnull=True) | Q(fecha_inicio__lte=ahora)
+            ).filter(
+                Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=ahora)
+            ),
+            'calificaciones (keyset)': CalificacionExamen.objects.filter(
+                fecha_completado__lt=calificacion.fecha_completado
+            ).order_by('-fecha_completado', '-id')[:20],
+            'calcular_promedios': PromedioPromocion.calificaciones_finales(
+                Inscripcion.objects.filter(promocion_id=inscripcion.promocion_id, activa=True)
+            ).values_list('inscripcion_id', 'porcentaje'),
+        }
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('verificar_planes requiere PostgreSQL')
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+            filas_por_tabla = dict(cursor.fetchall())
+
+        fallos = []
+        for nombre, queryset in self.consultas().items():
+            plan = queryset.explain(analyze=options['analyze'])
+            tablas = set(re.findall(r'Seq Scan on (\w+)', plan))
+            grandes = sorted(t for t in tablas if filas_por_tabla.get(t, 0) >= options['filas_minimas'])
+            if grandes:
+                fallos.append(nombre)
+                self.stdout.write(self.style.ERROR(f'✗ {nombre}: Seq Scan sobre {", ".join(grandes)}'))
+                self.stdout.write(plan)
+            else:
+                self.stdout.write(self.style.SUCCESS(f'✓ {nombre}'))
+
+        if fallos:
+            raise CommandError(f'{len(fallos)} consulta(s) con Seq Scan sobre tablas grandes')
+
+        self.stdout.write(self.style.SUCCESS('\n✓ Todas las consultas usan índices'))
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cursos', '0005_agregar_recuperaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IntentoExamen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('preguntas_ids', models.JSONField(default=list, help_text='IDs de las preguntas sorteadas, en el orden en que se muestran')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('examen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='intentos', to='cursos.examen')),
+                ('inscripcion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='intentos_examenes', to='cursos.inscripcion')),
+                ('recuperacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='intentos', to='cursos.recuperacionexamen')),
+            ],
+            options={
+                'verbose_name': 'Intento de Examen',
+                'verbose_name_plural': 'Intentos de Exámenes',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='intentoexamen',
+            constraint=models.UniqueConstraint(condition=models.Q(('recuperacion__isnull', True)), fields=('examen', 'inscripcion'), name='intento_examen_normal_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='intentoexamen',
+            constraint=models.UniqueConstraint(condition=models.Q(('recuperacion__isnull', False)), fields=('examen', 'inscripcion', 'recuperacion'), name='intento_examen_recuperacion_unico'),
+        ),
+    ]
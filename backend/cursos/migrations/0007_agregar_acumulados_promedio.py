@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:32
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+
+
+def inicializar_acumulados(apps, schema_editor):
+    """Calcula suma_porcentajes y examenes_calificados de los promedios existentes"""
+    CalificacionExamen = apps.get_model('cursos', 'CalificacionExamen')
+    PromedioPromocion = apps.get_model('cursos', 'PromedioPromocion')
+    
+    misma_pareja = CalificacionExamen.objects.filter(
+        inscripcion=OuterRef('inscripcion'),
+        examen=OuterRef('examen'),
+    )
+    posterior = misma_pareja.filter(
+        Q(fecha_completado__gt=OuterRef('fecha_completado')) |
+        Q(fecha_completado=OuterRef('fecha_completado'), id__gt=OuterRef('id'))
+    )
+    totales = (
+        CalificacionExamen.objects.filter(
+            inscripcion__promedio__isnull=False,
+            examen__tema__curso_id=F('inscripcion__promocion__curso_id'),
+        ).filter(
+            (Q(recuperacion__isnull=False) & ~Exists(posterior.filter(recuperacion__isnull=False))) |
+            (
+                Q(recuperacion__isnull=True) &
+                ~Exists(misma_pareja.filter(recuperacion__isnull=False)) &
+                ~Exists(posterior.filter(recuperacion__isnull=True))
+            )
+        )
+        .order_by()
+        .values('inscripcion_id')
+        .annotate(suma=Sum('porcentaje'), cantidad=Count('id'))
+    )
+    for total in totales:
+        PromedioPromocion.objects.filter(inscripcion_id=total['inscripcion_id']).update(
+            suma_porcentajes=total['suma'],
+            examenes_calificados=total['cantidad'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cursos', '0006_agregar_intentos_examen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promediopromocion',
+            name='examenes_calificados',
+            field=models.PositiveIntegerField(default=0, help_text='Cantidad de exámenes con calificación final (para el cálculo incremental)'),
+        ),
+        migrations.AddField(
+            model_name='promediopromocion',
+            name='suma_porcentajes',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Suma de los porcentajes finales de cada examen (para el cálculo incremental)', max_digits=8),
+        ),
+        migrations.RunPython(inicializar_acumulados, migrations.RunPython.noop),
+    ]
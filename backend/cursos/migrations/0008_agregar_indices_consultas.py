@@ -0,0 +1,119 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+
+
+def eliminar_calificaciones_normales_duplicadas(apps, schema_editor):
+    """
+    Conserva solo la primera calificación normal por (examen, inscripción) antes de crear la
+    restricción única, y recalcula los promedios de las inscripciones afectadas: 0007 sumó la
+    última calificación normal, que puede ser una de las eliminadas
+    """
+    CalificacionExamen = apps.get_model('cursos', 'CalificacionExamen')
+    PromedioPromocion = apps.get_model('cursos', 'PromedioPromocion')
+    
+    anterior = CalificacionExamen.objects.filter(
+        examen=OuterRef('examen'),
+        inscripcion=OuterRef('inscripcion'),
+        recuperacion__isnull=True,
+        id__lt=OuterRef('id'),
+    )
+    duplicadas = CalificacionExamen.objects.filter(recuperacion__isnull=True).filter(Exists(anterior))
+    afectadas = set(duplicadas.values_list('inscripcion_id', flat=True))
+    if not afectadas:
+        return
+    duplicadas.delete()
+    
+    # Sin duplicadas queda una calificación normal por pareja: la final es la última recuperación
+    # o, si no hubo recuperación, la normal
+    posterior = CalificacionExamen.objects.filter(
+        inscripcion=OuterRef('inscripcion'),
+        examen=OuterRef('examen'),
+        recuperacion__isnull=False,
+    ).filter(
+        Q(fecha_completado__gt=OuterRef('fecha_completado')) |
+        Q(fecha_completado=OuterRef('fecha_completado'), id__gt=OuterRef('id'))
+    )
+    recuperaciones = CalificacionExamen.objects.filter(
+        inscripcion=OuterRef('inscripcion'),
+        examen=OuterRef('examen'),
+        recuperacion__isnull=False,
+    )
+    totales = {
+        total['inscripcion_id']: total
+        for total in CalificacionExamen.objects.filter(
+            inscripcion_id__in=afectadas,
+            examen__tema__curso_id=F('inscripcion__promocion__curso_id'),
+        ).filter(
+            (Q(recuperacion__isnull=False) & ~Exists(posterior)) |
+            (Q(recuperacion__isnull=True) & ~Exists(recuperaciones))
+        )
+        .order_by()
+        .values('inscripcion_id')
+        .annotate(suma=Sum('porcentaje'), cantidad=Count('id'))
+    }
+    for promedio in PromedioPromocion.objects.filter(inscripcion_id__in=afectadas):
+        total = totales.get(promedio.inscripcion_id, {})
+        promedio.suma_porcentajes = Decimal(str(total.get('suma') or 0)).quantize(Decimal('0.01'))
+        promedio.examenes_calificados = total.get('cantidad') or 0
+        if promedio.examenes_calificados:
+            promedio.promedio_final = (
+                promedio.suma_porcentajes / promedio.examenes_calificados
+            ).quantize(Decimal('0.01'))
+        else:
+            promedio.promedio_final = Decimal('0.00')
+        promedio.aprobado = promedio.promedio_final >= 80
+        promedio.save(update_fields=['suma_porcentajes', 'examenes_calificados', 'promedio_final', 'aprobado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cursos', '0007_agregar_acumulados_promedio'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='calificacionexamen',
+            name='recuperacion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='calificacion', to='cursos.recuperacionexamen'),
+        ),
+        migrations.AlterField(
+            model_name='respuestaexamen',
+            name='recuperacion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='respuestas', to='cursos.recuperacionexamen'),
+        ),
+        migrations.AddIndex(
+            model_name='asistencia',
+            index=models.Index(fields=['tema', 'inscripcion'], name='asistencia_tema_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calificacionexamen',
+            index=models.Index(fields=['inscripcion', 'examen', 'fecha_completado'], name='calificacion_inscripcion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calificacionexamen',
+            index=models.Index(fields=['-fecha_completado', '-id'], name='calificacion_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examen',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['fecha_inicio', 'fecha_fin'], name='examen_disponible_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inscripcion',
+            index=models.Index(condition=models.Q(('activa', True)), fields=['alumno', 'promocion'], name='inscripcion_activa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='respuestaexamen',
+            index=models.Index(fields=['examen', 'inscripcion', 'recuperacion'], name='respuesta_intento_idx'),
+        ),
+        migrations.RunPython(eliminar_calificaciones_normales_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='calificacionexamen',
+            constraint=models.UniqueConstraint(condition=models.Q(('recuperacion__isnull', True)), fields=('examen', 'inscripcion'), name='calificacion_normal_unica'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:52
+
+import os
+
+import cursos.almacenamiento
+from django.db import migrations, models
+
+
+def completar_nombres_originales(apps, schema_editor):
+    """Los materiales anteriores conservan su ruta en materiales/; su nombre original es el de esa ruta"""
+    Material = apps.get_model('cursos', 'Material')
+    materiales = list(Material.objects.filter(nombre_original='').only('id', 'archivo'))
+    for material in materiales:
+        material.nombre_original = os.path.basename(material.archivo.name)
+    Material.objects.bulk_update(materiales, ['nombre_original'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cursos', '0008_agregar_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoMaterial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_contenido', models.CharField(max_length=64, unique=True)),
+                ('tamano', models.BigIntegerField(default=0)),
+                ('referencias', models.PositiveIntegerField(default=0)),
+                ('huerfano_desde', models.DateTimeField(blank=True, null=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archivo de Material',
+                'verbose_name_plural': 'Archivos de Materiales',
+            },
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='nombre_original',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='material',
+            name='archivo',
+            field=models.FileField(storage=cursos.almacenamiento.AlmacenamientoDeduplicado(), upload_to='materiales/'),
+        ),
+        migrations.RunPython(completar_nombres_originales, migrations.RunPython.noop),
+    ]
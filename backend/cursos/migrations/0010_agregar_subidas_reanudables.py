@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cursos', '0009_agregar_almacenamiento_deduplicado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubidaMaterial',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('titulo', models.CharField(max_length=200)),
+                ('descripcion', models.TextField(blank=True, null=True)),
+                ('nombre_original', models.CharField(max_length=255)),
+                ('tamano_total', models.BigIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('recibidos', models.BigIntegerField(default=0)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('completada', 'Completada')], default='pendiente', max_length=20)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('material', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cursos.material')),
+                ('tema', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subidas_materiales', to='cursos.tema')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subidas_materiales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Subida de Material',
+                'verbose_name_plural': 'Subidas de Materiales',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+    ]
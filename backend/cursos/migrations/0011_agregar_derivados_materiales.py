@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cursos', '0010_agregar_subidas_reanudables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivomaterial',
+            name='derivados_procesados',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DerivadoArchivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variante', models.CharField(choices=[('miniatura', 'Miniatura'), ('vista_previa', 'Vista previa'), ('gzip', 'Comprimido gzip'), ('br', 'Comprimido brotli')], max_length=20)),
+                ('tamano', models.BigIntegerField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('archivo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivados', to='cursos.archivomaterial')),
+            ],
+            options={
+                'verbose_name': 'Derivado de Archivo',
+                'verbose_name_plural': 'Derivados de Archivos',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='derivadoarchivo',
+            constraint=models.UniqueConstraint(fields=('archivo', 'variante'), name='derivado_archivo_variante_unico'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cursos', '0011_agregar_derivados_materiales'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subidamaterial',
+            name='estado',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('finalizando', 'Finalizando'), ('completada', 'Completada')], default='pendiente', max_length=20),
+        ),
+    ]
@@ -1,7 +1,22 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Sum, When, Window
+from django.db.models.functions import RowNumber
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from decimal import Decimal
+import glob
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from .almacenamiento import almacenamiento_materiales, hash_de_nombre, nombre_de_hash, nombre_derivado
 
 
 class Curso(models.Model):
@@ -66,6 +81,24 @@ class Tema(models.Model):
     
     def __str__(self):
         return f"{self.curso.nombre} - Tema {self.numero_tema}: {self.titulo}"
+    
+    @staticmethod
+    def cache_key_ids_preguntas(tema_id):
+        return f'cursos:tema:{tema_id}:ids_preguntas'
+    
+    @classmethod
+    def invalidar_ids_preguntas(cls, *tema_ids):
+        """Elimina de la caché la lista de IDs del banco de preguntas de los temas indicados"""
+        cache.delete_many([cls.cache_key_ids_preguntas(tema_id) for tema_id in tema_ids if tema_id])
+    
+    def obtener_ids_preguntas(self):
+        """Retorna la lista ordenada de IDs del banco de preguntas del tema (cacheada)"""
+        key = self.cache_key_ids_preguntas(self.id)
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.preguntas.order_by('id').values_list('id', flat=True))
+            cache.set(key, ids, settings.PREGUNTAS_CACHE_TIMEOUT)
+        return ids
 
 
 class Material(models.Model):
@@ -73,7 +106,10 @@ class Material(models.Model):
     tema = models.ForeignKey(Tema, on_delete=models.CASCADE, related_name='materiales')
     titulo = models.CharField(max_length=200)
     descripcion = models.TextField(blank=True, null=True)
-    archivo = models.FileField(upload_to='materiales/')
+    # Los archivos se guardan una sola vez por contenido (blobs/<hash>); el nombre original
+    # se conserva aparte para las descargas
+    archivo = models.FileField(upload_to='materiales/', storage=almacenamiento_materiales)
+    nombre_original = models.CharField(max_length=255, blank=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -83,6 +119,284 @@ class Material(models.Model):
     
     def __str__(self):
         return f"{self.tema} - {self.titulo}"
+    
+    def save(self, *args, **kwargs):
+        # Archivo recién asignado: guardar su nombre antes de que el almacenamiento lo reemplace por el hash
+        if self.archivo and not self.archivo._committed:
+            self.nombre_original = os.path.basename(self.archivo.name)
+        super().save(*args, **kwargs)
+    
+    @property
+    def nombre_descarga(self):
+        return self.nombre_original or os.path.basename(self.archivo.name)
+    
+    @property
+    def hash_contenido(self):
+        return hash_de_nombre(self.archivo.name)
+
+
+class ArchivoMaterial(models.Model):
+    """Conteo de referencias de cada blob del almacenamiento deduplicado de materiales"""
+    hash_contenido = models.CharField(max_length=64, unique=True)
+    tamano = models.BigIntegerField(default=0)
+    referencias = models.PositiveIntegerField(default=0)
+    # Momento en que quedó sin referencias; la limpieza espera un periodo de gracia desde aquí
+    huerfano_desde = models.DateTimeField(null=True, blank=True)
+    # Ya se intentó generar sus derivados (miniaturas, versiones comprimidas); ver cursos.derivados
+    derivados_procesados = models.BooleanField(default=False)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Archivo de Material'
+        verbose_name_plural = 'Archivos de Materiales'
+    
+    def __str__(self):
+        return f"{self.hash_contenido} ({self.referencias} referencias)"
+    
+    @property
+    def nombre(self):
+        return nombre_de_hash(self.hash_contenido)
+    
+    @classmethod
+    def registrar_referencia(cls, nombre):
+        """Suma una referencia al blob `nombre` (los archivos anteriores a la deduplicación se ignoran)"""
+        hash_contenido = hash_de_nombre(nombre)
+        if not hash_contenido:
+            return
+        with transaction.atomic():
+            archivo, creado = cls.objects.select_for_update().get_or_create(
+                hash_contenido=hash_contenido,
+                defaults={'tamano': almacenamiento_materiales.size(nombre)},
+            )
+            archivo.referencias = F('referencias') + 1
+            archivo.huerfano_desde = None
+            archivo.save(update_fields=['referencias', 'huerfano_desde'])
+    
+    @classmethod
+    def liberar_referencia(cls, nombre):
+        """Resta una referencia; si el blob queda huérfano se intenta borrar al confirmar la transacción"""
+        hash_contenido = hash_de_nombre(nombre)
+        if not hash_contenido:
+            return
+        with transaction.atomic():
+            archivo = cls.objects.select_for_update().filter(hash_contenido=hash_contenido).first()
+            if archivo is None:
+                return
+            archivo.referencias = max(archivo.referencias - 1, 0)
+            if archivo.referencias == 0:
+                archivo.huerfano_desde = timezone.now()
+            archivo.save(update_fields=['referencias', 'huerfano_desde'])
+            if archivo.referencias == 0:
+                transaction.on_commit(lambda: cls.limpiar_huerfanos(hash_contenido=hash_contenido))
+    
+    @classmethod
+    def limpiar_huerfanos(cls, gracia=None, hash_contenido=None):
+        """
+        Borra los blobs sin referencias. Un blob cuyo archivo se tocó hace menos de `gracia`
+        segundos se conserva: puede pertenecer a una subida en curso con el mismo contenido que
+        todavía no registró su referencia. Retorna la cantidad de blobs eliminados.
+        """
+        if gracia is None:
+            gracia = settings.MATERIALES_GRACIA_HUERFANOS
+        candidatos = cls.objects.filter(referencias=0)
+        if hash_contenido:
+            candidatos = candidatos.filter(hash_contenido=hash_contenido)
+        
+        eliminados = 0
+        limite = time.time() - gracia
+        for candidato_id in candidatos.values_list('id', flat=True):
+            with transaction.atomic():
+                archivo = cls.objects.select_for_update().filter(id=candidato_id, referencias=0).first()
+                if archivo is None:
+                    continue
+                nombre = archivo.nombre
+                if almacenamiento_materiales.exists(nombre):
+                    if os.path.getmtime(almacenamiento_materiales.path(nombre)) > limite:
+                        continue
+                    almacenamiento_materiales.delete(nombre)
+                archivo.delete()
+                eliminados += 1
+        return eliminados
+
+
+
+
+class DerivadoArchivo(models.Model):
+    """Versión derivada de un archivo de material: miniatura, vista previa o versión comprimida"""
+    VARIANTE_CHOICES = [
+        ('miniatura', 'Miniatura'),
+        ('vista_previa', 'Vista previa'),
+        ('gzip', 'Comprimido gzip'),
+        ('br', 'Comprimido brotli'),
+    ]
+    
+    archivo = models.ForeignKey(ArchivoMaterial, on_delete=models.CASCADE, related_name='derivados')
+    variante = models.CharField(max_length=20, choices=VARIANTE_CHOICES)
+    tamano = models.BigIntegerField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Derivado de Archivo'
+        verbose_name_plural = 'Derivados de Archivos'
+        constraints = [
+            models.UniqueConstraint(fields=['archivo', 'variante'], name='derivado_archivo_variante_unico'),
+        ]
+    
+    def __str__(self):
+        return f"{self.archivo.hash_contenido} - {self.get_variante_display()}"
+    
+    @property
+    def nombre(self):
+        return nombre_derivado(self.archivo.hash_contenido, self.variante)
+
+
+class SubidaMaterial(models.Model):
+    """
+    Subida reanudable de un material en fragmentos: se inicia, se envían los fragmentos en orden
+    (se puede reanudar desde `recibidos`) y se finaliza verificando el SHA-256 declarado.
+    Los fragmentos se escriben directamente en un archivo temporal en SUBIDAS_DIRECTORIO.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('finalizando', 'Finalizando'),
+        ('completada', 'Completada'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subidas_materiales')
+    tema = models.ForeignKey(Tema, on_delete=models.CASCADE, related_name='subidas_materiales')
+    titulo = models.CharField(max_length=200)
+    descripcion = models.TextField(blank=True, null=True)
+    nombre_original = models.CharField(max_length=255)
+    tamano_total = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    recibidos = models.BigIntegerField(default=0)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    material = models.ForeignKey(Material, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Subida de Material'
+        verbose_name_plural = 'Subidas de Materiales'
+        ordering = ['-fecha_creacion']
+    
+    def __str__(self):
+        return f"{self.nombre_original} ({self.recibidos}/{self.tamano_total})"
+    
+    @property
+    def ruta_temporal(self):
+        return os.path.join(settings.SUBIDAS_DIRECTORIO, f'{self.id}.parte')
+    
+    def validar_fragmento(self, inicio, longitud):
+        """
+        `inicio` puede ser menor que lo recibido (reintento de un fragmento ya escrito) pero no
+        mayor, para no dejar huecos, y el fragmento no puede pasar del tamaño declarado
+        """
+        if inicio > self.recibidos:
+            raise ValueError(f'El fragmento debe comenzar en {self.recibidos} o antes')
+        if inicio + longitud > self.tamano_total:
+            raise ValueError('El fragmento excede el tamaño declarado del archivo')
+    
+    def recibir_fragmento(self, flujo, longitud):
+        """
+        Copia `longitud` bytes de `flujo` (el cuerpo de la petición) por bloques a un archivo propio
+        del fragmento, sin bloquear la fila: la transferencia desde el cliente puede ser lenta.
+        Retorna la ruta del archivo; quien llama debe borrarlo.
+        """
+        os.makedirs(settings.SUBIDAS_DIRECTORIO, exist_ok=True)
+        descriptor, ruta = tempfile.mkstemp(dir=settings.SUBIDAS_DIRECTORIO, prefix=f'{self.id}.', suffix='.fragmento')
+        escritos = 0
+        with os.fdopen(descriptor, 'wb') as destino:
+            while escritos < longitud:
+                bloque = flujo.read(min(64 * 1024, longitud - escritos))
+                if not bloque:
+                    break
+                destino.write(bloque)
+                escritos += len(bloque)
+        if escritos != longitud:
+            os.remove(ruta)
+            raise ValueError(f'Se esperaban {longitud} bytes y se recibieron {escritos}')
+        return ruta
+    
+    def escribir_fragmento(self, inicio, ruta_fragmento):
+        """
+        Copia el fragmento ya recibido (ver recibir_fragmento) al archivo temporal a partir de
+        `inicio`. Debe llamarse con la fila bloqueada (select_for_update): es una copia local, así
+        que el bloqueo dura poco aunque el cliente haya enviado el fragmento lentamente.
+        """
+        longitud = os.path.getsize(ruta_fragmento)
+        self.validar_fragmento(inicio, longitud)
+        
+        modo = 'r+b' if os.path.exists(self.ruta_temporal) else 'wb'
+        with open(ruta_fragmento, 'rb') as origen, open(self.ruta_temporal, modo) as destino:
+            destino.seek(inicio)
+            shutil.copyfileobj(origen, destino, 1024 * 1024)
+        
+        self.recibidos = max(self.recibidos, inicio + longitud)
+        self.save(update_fields=['recibidos', 'fecha_actualizacion'])
+    
+    def finalizar(self):
+        """
+        Verifica tamaño y checksum y crea el Material a partir del archivo temporal. La fila solo
+        se bloquea para marcarla como 'finalizando' (rechaza fragmentos y finalizaciones
+        concurrentes); la copia al almacenamiento, que calcula el SHA-256 mientras escribe, se hace
+        fuera de la transacción.
+        """
+        with transaction.atomic():
+            subida = SubidaMaterial.objects.select_for_update().get(pk=self.pk)
+            if subida.estado == 'completada':
+                return subida.material
+            if subida.estado == 'finalizando':
+                raise ValueError('La subida ya se está finalizando')
+            if subida.recibidos != subida.tamano_total:
+                raise ValueError(f'Faltan bytes: recibidos {subida.recibidos} de {subida.tamano_total}')
+            subida.estado = 'finalizando'
+            subida.save(update_fields=['estado', 'fecha_actualizacion'])
+        self.estado = subida.estado
+        self.recibidos = subida.recibidos
+        
+        try:
+            material = self.guardar_material()
+        except Exception:
+            self.estado = 'pendiente'
+            self.save(update_fields=['estado', 'fecha_actualizacion'])
+            raise
+        
+        with transaction.atomic():
+            material.save()
+            self.material = material
+            self.estado = 'completada'
+            self.save(update_fields=['material', 'estado', 'fecha_actualizacion'])
+        self.eliminar_temporal()
+        return material
+    
+    def guardar_material(self):
+        """
+        Guarda el archivo temporal en el almacenamiento y retorna el Material sin guardar. El
+        almacenamiento nombra el blob por su SHA-256, así que el checksum se verifica con ese
+        nombre sin volver a leer el archivo. Si no coincide, el blob queda sin referencias y lo
+        borra limpiar_materiales.
+        """
+        if not os.path.exists(self.ruta_temporal):
+            # Archivo vacío: nunca se envió ningún fragmento
+            os.makedirs(settings.SUBIDAS_DIRECTORIO, exist_ok=True)
+            open(self.ruta_temporal, 'wb').close()
+        material = Material(
+            tema=self.tema, titulo=self.titulo, descripcion=self.descripcion,
+            nombre_original=self.nombre_original
+        )
+        with open(self.ruta_temporal, 'rb') as temporal:
+            material.archivo.save(self.nombre_original, File(temporal), save=False)
+        if self.tamano_total and material.hash_contenido != self.sha256:
+            raise ValueError('El checksum SHA-256 no coincide con el archivo recibido')
+        return material
+    
+    def eliminar_temporal(self):
+        # También los fragmentos que quedaron de peticiones interrumpidas
+        for ruta in [self.ruta_temporal, *glob.glob(os.path.join(settings.SUBIDAS_DIRECTORIO, f'{self.id}.*.fragmento'))]:
+            if os.path.exists(ruta):
+                os.remove(ruta)
 
 
 class Inscripcion(models.Model):
@@ -102,9 +416,48 @@ class Inscripcion(models.Model):
         verbose_name_plural = 'Inscripciones'
         unique_together = ['alumno', 'promocion']
         ordering = ['-fecha_inscripcion']
+        indexes = [
+            # Alcance del alumno: inscripciones activas
+            models.Index(fields=['alumno', 'promocion'], condition=models.Q(activa=True), name='inscripcion_activa_idx'),
+        ]
     
     def __str__(self):
         return f"{self.alumno} - {self.promocion}"
+    
+    @staticmethod
+    def cache_key_alcance(alumno_id):
+        return f'cursos:alumno:{alumno_id}:alcance'
+    
+    @classmethod
+    def invalidar_alcance(cls, *alumno_ids):
+        """Elimina de la caché el alcance de inscripciones de los alumnos indicados"""
+        cache.delete_many([cls.cache_key_alcance(alumno_id) for alumno_id in alumno_ids if alumno_id])
+    
+    @classmethod
+    def obtener_alcance(cls, alumno):
+        """
+        Retorna {'promocion_ids': [...], 'curso_ids': [...]} con las inscripciones activas del alumno.
+        
+        Se guarda en caché por usuario (invalidada al cambiar sus inscripciones) y en el propio
+        objeto usuario, así que los viewsets de una misma petición no vuelven a consultarlo.
+        """
+        alcance = getattr(alumno, '_alcance_inscripciones', None)
+        if alcance is not None:
+            return alcance
+        
+        key = cls.cache_key_alcance(alumno.pk)
+        alcance = cache.get(key)
+        if alcance is None:
+            filas = cls.objects.filter(alumno=alumno, activa=True).values_list('promocion_id', 'promocion__curso_id')
+            promocion_ids, curso_ids = set(), set()
+            for promocion_id, curso_id in filas:
+                promocion_ids.add(promocion_id)
+                curso_ids.add(curso_id)
+            alcance = {'promocion_ids': sorted(promocion_ids), 'curso_ids': sorted(curso_ids)}
+            cache.set(key, alcance, settings.ALCANCE_CACHE_TIMEOUT)
+        
+        alumno._alcance_inscripciones = alcance
+        return alcance
 
 
 class Asistencia(models.Model):
@@ -128,6 +481,10 @@ class Asistencia(models.Model):
         verbose_name_plural = 'Asistencias'
         unique_together = ['inscripcion', 'tema']
         ordering = ['tema', 'inscripcion']
+        indexes = [
+            # Lista de asistencia por tema (filtro ?tema= y orden por defecto)
+            models.Index(fields=['tema', 'inscripcion'], name='asistencia_tema_idx'),
+        ]
     
     def __str__(self):
         return f"{self.inscripcion.alumno} - {self.tema} - {self.get_tipo_asistencia_display()}"
@@ -159,6 +516,12 @@ class Pregunta(models.Model):
     
     def __str__(self):
         return f"{self.tema} - {self.pregunta_texto[:50]}..."
+    
+    def es_respuesta_correcta(self, respuesta_dada):
+        """Retorna True si la respuesta dada coincide con la respuesta correcta (solo preguntas cerradas)"""
+        if self.tipo_pregunta not in ('opcion_multiple', 'verdadero_falso'):
+            return False
+        return (respuesta_dada or '').lower().strip() == (self.respuesta_correcta or '').lower().strip()
 
 
 class Examen(models.Model):
@@ -186,6 +549,10 @@ class Examen(models.Model):
         verbose_name = 'Examen'
         verbose_name_plural = 'Exámenes'
         ordering = ['-fecha_creacion']
+        indexes = [
+            # Exámenes disponibles ahora (activo y dentro de las fechas)
+            models.Index(fields=['fecha_inicio', 'fecha_fin'], condition=models.Q(activo=True), name='examen_disponible_idx'),
+        ]
     
     def __str__(self):
         return f"Examen de {self.tema}"
@@ -195,20 +562,36 @@ class Examen(models.Model):
         """Retorna el puntaje total del examen (numero_preguntas * puntos_por_pregunta)"""
         return self.numero_preguntas * self.puntos_por_pregunta
     
-    def obtener_preguntas_aleatorias(self):
-        """Retorna número_preguntas preguntas aleatorias del banco del tema"""
-        from django.db.models import Count
-        preguntas_disponibles = self.tema.preguntas.all()
-        cantidad_disponible = preguntas_disponibles.count()
+    def obtener_preguntas_aleatorias(self, semilla=None):
+        """
+        Retorna una lista con número_preguntas preguntas aleatorias del banco del tema.
         
-        if cantidad_disponible == 0:
-            return Pregunta.objects.none()
-        
-        # Si hay menos preguntas disponibles que las solicitadas, retornar todas
-        cantidad_a_seleccionar = min(self.numero_preguntas, cantidad_disponible)
+        El muestreo se hace en memoria sobre la lista cacheada de IDs del tema y luego
+        se obtienen las preguntas con una sola consulta id__in, en lugar de ordenar todo
+        el banco con ORDER BY RANDOM(). Con la misma semilla se obtiene el mismo sorteo.
+        """
+        for _ in range(2):
+            ids_disponibles = self.tema.obtener_ids_preguntas()
+            if not ids_disponibles:
+                return []
+            
+            # Si hay menos preguntas disponibles que las solicitadas, retornar todas
+            cantidad_a_seleccionar = min(self.numero_preguntas, len(ids_disponibles))
+            ids_seleccionados = random.Random(semilla).sample(ids_disponibles, cantidad_a_seleccionar)
+            
+            preguntas = Pregunta.objects.in_bulk(ids_seleccionados)
+            if len(preguntas) == len(ids_seleccionados):
+                return [preguntas[pregunta_id] for pregunta_id in ids_seleccionados]
+            
+            # La caché quedó desactualizada (preguntas eliminadas): recargarla y volver a sortear
+            Tema.invalidar_ids_preguntas(self.tema_id)
         
-        # Seleccionar preguntas aleatorias
-        return preguntas_disponibles.order_by('?')[:cantidad_a_seleccionar]
+        return [preguntas[pregunta_id] for pregunta_id in ids_seleccionados if pregunta_id in preguntas]
+    
+    def semilla_intento(self, inscripcion, recuperacion=None):
+        """Semilla reproducible para el sorteo de preguntas de un intento (examen, inscripción, recuperación)"""
+        recuperacion_id = recuperacion.id if recuperacion else 0
+        return f"{settings.SECRET_KEY}:{self.id}:{inscripcion.id}:{recuperacion_id}"
 
 
 class RespuestaExamen(models.Model):
@@ -216,7 +599,9 @@ class RespuestaExamen(models.Model):
     examen = models.ForeignKey(Examen, on_delete=models.CASCADE, related_name='respuestas')
     inscripcion = models.ForeignKey(Inscripcion, on_delete=models.CASCADE, related_name='respuestas_examenes')
     pregunta = models.ForeignKey(Pregunta, on_delete=models.CASCADE, related_name='respuestas')
-    recuperacion = models.ForeignKey('RecuperacionExamen', on_delete=models.SET_NULL, null=True, blank=True, related_name='respuestas')
+    # CASCADE: eliminar una recuperación ya rendida borra de forma definitiva las respuestas
+    # corregidas del alumno en ella (y su calificación, ver CalificacionExamen.recuperacion)
+    recuperacion = models.ForeignKey('RecuperacionExamen', on_delete=models.CASCADE, null=True, blank=True, related_name='respuestas')
     respuesta_dada = models.TextField()
     es_correcta = models.BooleanField(default=False)
     puntos_obtenidos = models.DecimalField(max_digits=5, decimal_places=2, default=0)
@@ -227,6 +612,9 @@ class RespuestaExamen(models.Model):
         verbose_name_plural = 'Respuestas de Exámenes'
         unique_together = ['examen', 'inscripcion', 'pregunta', 'recuperacion']
         ordering = ['examen', 'inscripcion', 'pregunta']
+        indexes = [
+            models.Index(fields=['examen', 'inscripcion', 'recuperacion'], name='respuesta_intento_idx'),
+        ]
     
     def __str__(self):
         tipo = f" (Recuperación {self.recuperacion.id})" if self.recuperacion else ""
@@ -254,18 +642,149 @@ class RecuperacionExamen(models.Model):
     @property
     def numero_recuperacion(self):
         """Retorna el número de recuperación que es este estudiante en este examen"""
+        # Si el queryset ya trae el ordinal calculado (ventana ROW_NUMBER), no consultar de nuevo
+        orden = getattr(self, 'orden_recuperacion', None)
+        if orden is not None:
+            return orden
         return RecuperacionExamen.objects.filter(
             examen=self.examen,
             inscripcion=self.inscripcion,
             fecha_creacion__lte=self.fecha_creacion
         ).count()
+    
+    @staticmethod
+    def ventana_numero_recuperacion():
+        """Expresión ROW_NUMBER() por (examen, inscripción) equivalente a numero_recuperacion"""
+        return Window(
+            expression=RowNumber(),
+            partition_by=[F('examen_id'), F('inscripcion_id')],
+            order_by=[F('fecha_creacion').asc(), F('id').asc()],
+        )
+    
+    @classmethod
+    def asignar_numeros_recuperacion(cls, recuperaciones):
+        """Calcula numero_recuperacion para una lista de recuperaciones con una sola consulta"""
+        recuperaciones = list(recuperaciones)
+        if not recuperaciones:
+            return recuperaciones
+        
+        ordenes = dict(
+            cls.objects.filter(
+                examen_id__in={r.examen_id for r in recuperaciones},
+                inscripcion_id__in={r.inscripcion_id for r in recuperaciones},
+            ).annotate(
+                orden=cls.ventana_numero_recuperacion()
+            ).values_list('id', 'orden')
+        )
+        for recuperacion in recuperaciones:
+            recuperacion.orden_recuperacion = ordenes.get(recuperacion.id)
+        return recuperaciones
+
+
+class IntentoExamen(models.Model):
+    """Modelo para guardar las preguntas sorteadas a un alumno en un intento de examen (normal o recuperación)"""
+    examen = models.ForeignKey(Examen, on_delete=models.CASCADE, related_name='intentos')
+    inscripcion = models.ForeignKey(Inscripcion, on_delete=models.CASCADE, related_name='intentos_examenes')
+    recuperacion = models.ForeignKey(RecuperacionExamen, on_delete=models.CASCADE, null=True, blank=True, related_name='intentos')
+    preguntas_ids = models.JSONField(default=list, help_text='IDs de las preguntas sorteadas, en el orden en que se muestran')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Intento de Examen'
+        verbose_name_plural = 'Intentos de Exámenes'
+        ordering = ['-fecha_creacion']
+        constraints = [
+            # Un solo intento normal por alumno y examen, y uno por cada recuperación
+            models.UniqueConstraint(
+                fields=['examen', 'inscripcion'],
+                condition=models.Q(recuperacion__isnull=True),
+                name='intento_examen_normal_unico',
+            ),
+            models.UniqueConstraint(
+                fields=['examen', 'inscripcion', 'recuperacion'],
+                condition=models.Q(recuperacion__isnull=False),
+                name='intento_examen_recuperacion_unico',
+            ),
+        ]
+    
+    def __str__(self):
+        tipo = f" (Recuperación {self.recuperacion_id})" if self.recuperacion_id else ""
+        return f"Intento - {self.inscripcion} - {self.examen}{tipo}"
+    
+    @classmethod
+    def obtener_o_sortear(cls, examen, inscripcion, recuperacion=None):
+        """
+        Retorna el intento del alumno, sorteando y guardando sus preguntas solo la primera vez.
+        Se vuelve a sortear si el sorteo guardado ya no tiene examen.numero_preguntas preguntas
+        (cambió el examen o se eliminaron preguntas del banco). Retorna None si el banco no tiene
+        suficientes preguntas: un sorteo incompleto nunca se guarda.
+        """
+        filtros = {'examen': examen, 'inscripcion': inscripcion, 'recuperacion': recuperacion}
+        intento = cls.objects.filter(**filtros).first()
+        if intento is not None:
+            intento.examen = examen
+            if intento.sorteo_completo():
+                return intento
+            return intento if intento.volver_a_sortear() else None
+        
+        preguntas = examen.obtener_preguntas_aleatorias(semilla=examen.semilla_intento(inscripcion, recuperacion))
+        if len(preguntas) < examen.numero_preguntas:
+            return None
+        try:
+            with transaction.atomic():
+                intento = cls.objects.create(preguntas_ids=[pregunta.id for pregunta in preguntas], **filtros)
+        except IntegrityError:
+            # Otra petición concurrente del mismo alumno ya guardó el intento
+            return cls.objects.get(**filtros)
+        
+        intento._preguntas = preguntas
+        return intento
+    
+    def obtener_preguntas(self):
+        """Retorna las preguntas del intento en el orden sorteado (una sola consulta)"""
+        preguntas = getattr(self, '_preguntas', None)
+        if preguntas is None:
+            en_bulk = Pregunta.objects.in_bulk(self.preguntas_ids)
+            preguntas = [en_bulk[pregunta_id] for pregunta_id in self.preguntas_ids if pregunta_id in en_bulk]
+            self._preguntas = preguntas
+        return preguntas
+    
+    def sorteo_completo(self):
+        """True si el sorteo guardado coincide con el número de preguntas actual del examen y todas existen"""
+        return (
+            len(self.preguntas_ids) == self.examen.numero_preguntas
+            and len(self.obtener_preguntas()) == len(self.preguntas_ids)
+        )
+    
+    def volver_a_sortear(self):
+        """
+        Sortea de nuevo las preguntas del intento. Solo se guarda si el banco alcanza para
+        examen.numero_preguntas; si no, retorna una lista vacía y el intento queda como estaba.
+        """
+        preguntas = self.examen.obtener_preguntas_aleatorias(
+            semilla=f"{self.examen.semilla_intento(self.inscripcion, self.recuperacion)}:{self.preguntas_ids}"
+        )
+        if len(preguntas) < self.examen.numero_preguntas:
+            return []
+        self.preguntas_ids = [pregunta.id for pregunta in preguntas]
+        self.save(update_fields=['preguntas_ids'])
+        self._preguntas = preguntas
+        return preguntas
+    
+    @property
+    def puntaje_total(self):
+        """Puntaje máximo del intento según las preguntas sorteadas (no la configuración actual del examen)"""
+        return len(self.preguntas_ids) * self.examen.puntos_por_pregunta
 
 
 class CalificacionExamen(models.Model):
     """Modelo para almacenar las calificaciones finales de los exámenes"""
     examen = models.ForeignKey(Examen, on_delete=models.CASCADE, related_name='calificaciones')
     inscripcion = models.ForeignKey(Inscripcion, on_delete=models.CASCADE, related_name='calificaciones_examenes')
-    recuperacion = models.ForeignKey(RecuperacionExamen, on_delete=models.SET_NULL, null=True, blank=True, related_name='calificacion')
+    # CASCADE: con SET_NULL la calificación de una recuperación eliminada pasaría a ser una segunda
+    # calificación normal. El promedio se recalcula en la señal post_delete de RecuperacionExamen
+    # Eliminar una recuperación rendida pierde esa calificación y sus respuestas: no hay papelera
+    recuperacion = models.ForeignKey(RecuperacionExamen, on_delete=models.CASCADE, null=True, blank=True, related_name='calificacion')
     puntaje_obtenido = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     puntaje_total = models.DecimalField(max_digits=5, decimal_places=2)
     porcentaje = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0), MaxValueValidator(100)])
@@ -278,6 +797,20 @@ class CalificacionExamen(models.Model):
         # Permite múltiples calificaciones si son recuperaciones, pero solo una normal
         unique_together = [['examen', 'inscripcion', 'recuperacion']]
         ordering = ['-fecha_completado']
+        constraints = [
+            # unique_together no impide duplicados cuando recuperacion es NULL: una sola calificación normal
+            models.UniqueConstraint(
+                fields=['examen', 'inscripcion'],
+                condition=models.Q(recuperacion__isnull=True),
+                name='calificacion_normal_unica',
+            ),
+        ]
+        indexes = [
+            # Calificaciones finales por inscripción (promedios y exportación)
+            models.Index(fields=['inscripcion', 'examen', 'fecha_completado'], name='calificacion_inscripcion_idx'),
+            # Listado y paginación keyset
+            models.Index(fields=['-fecha_completado', '-id'], name='calificacion_fecha_idx'),
+        ]
     
     def __str__(self):
         tipo = "Recuperación" if self.recuperacion else "Normal"
@@ -286,7 +819,7 @@ class CalificacionExamen(models.Model):
     @property
     def es_recuperacion(self):
         """Retorna True si esta calificación es de una recuperación"""
-        return self.recuperacion is not None
+        return self.recuperacion_id is not None
     
     def calcular_calificacion(self):
         """Calcula la calificación basándose en las respuestas"""
@@ -324,6 +857,14 @@ class PromedioPromocion(models.Model):
     inscripcion = models.OneToOneField(Inscripcion, on_delete=models.CASCADE, related_name='promedio')
     promedio_final = models.DecimalField(max_digits=5, decimal_places=2, default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
     aprobado = models.BooleanField(default=False)
+    suma_porcentajes = models.DecimalField(
+        max_digits=8, decimal_places=2, default=0,
+        help_text='Suma de los porcentajes finales de cada examen (para el cálculo incremental)'
+    )
+    examenes_calificados = models.PositiveIntegerField(
+        default=0,
+        help_text='Cantidad de exámenes con calificación final (para el cálculo incremental)'
+    )
     fecha_calculo = models.DateTimeField(auto_now=True)
     
     class Meta:
@@ -334,43 +875,152 @@ class PromedioPromocion(models.Model):
     def __str__(self):
         return f"{self.inscripcion.alumno} - {self.inscripcion.promocion} - {self.promedio_final}%"
     
+    @staticmethod
+    def calificaciones_finales(inscripciones):
+        """
+        Retorna un queryset con la calificación final de cada (inscripción, examen) del curso:
+        la recuperación más reciente si existe, o la calificación normal en caso contrario.
+        
+        Se resuelve en una sola consulta con subconsultas EXISTS, sin recorrer los exámenes.
+        """
+        misma_pareja = CalificacionExamen.objects.filter(
+            inscripcion=OuterRef('inscripcion'),
+            examen=OuterRef('examen'),
+        )
+        posterior = misma_pareja.filter(
+            Q(fecha_completado__gt=OuterRef('fecha_completado')) |
+            Q(fecha_completado=OuterRef('fecha_completado'), id__gt=OuterRef('id'))
+        )
+        return CalificacionExamen.objects.filter(
+            inscripcion__in=inscripciones,
+            examen__tema__curso_id=F('inscripcion__promocion__curso_id'),
+        ).filter(
+            # Recuperación más reciente
+            (Q(recuperacion__isnull=False) & ~Exists(posterior.filter(recuperacion__isnull=False))) |
+            # Calificación normal, solo si no hay ninguna recuperación
+            (
+                Q(recuperacion__isnull=True) &
+                ~Exists(misma_pareja.filter(recuperacion__isnull=False)) &
+                ~Exists(posterior.filter(recuperacion__isnull=True))
+            )
+        )
+    
+    def _asignar_totales(self, suma, cantidad):
+        """Actualiza los acumulados y deriva de ellos el promedio final y el estado de aprobación"""
+        self.suma_porcentajes = Decimal(str(suma or 0)).quantize(Decimal('0.01'))
+        self.examenes_calificados = cantidad or 0
+        if self.examenes_calificados:
+            self.promedio_final = (self.suma_porcentajes / self.examenes_calificados).quantize(Decimal('0.01'))
+        else:
+            self.promedio_final = Decimal('0.00')
+        # Aprobado si promedio >= 80%
+        self.aprobado = self.promedio_final >= 80
+    
     def calcular_promedio(self):
         """Calcula el promedio final de todos los exámenes de la promoción"""
-        # Obtener todos los exámenes del curso de la promoción
-        examenes = Examen.objects.filter(tema__curso=self.inscripcion.promocion.curso)
+        totales = self.calificaciones_finales(
+            Inscripcion.objects.filter(pk=self.inscripcion_id)
+        ).aggregate(suma=Sum('porcentaje'), cantidad=Count('id'))
         
-        calificaciones_finales = []
-        for examen in examenes:
-            # Buscar calificación de recuperación primero (la más reciente si hay varias)
-            calificacion_recuperacion = CalificacionExamen.objects.filter(
-                inscripcion=self.inscripcion,
-                examen=examen,
-                recuperacion__isnull=False
-            ).order_by('-fecha_completado').first()
-            
-            if calificacion_recuperacion:
-                # Si hay recuperación, usar esa calificación
-                calificaciones_finales.append(calificacion_recuperacion)
-            else:
-                # Si no hay recuperación, usar la calificación normal
-                calificacion_normal = CalificacionExamen.objects.filter(
-                    inscripcion=self.inscripcion,
-                    examen=examen,
-                    recuperacion__isnull=True
-                ).first()
-                
-                if calificacion_normal:
-                    calificaciones_finales.append(calificacion_normal)
+        self._asignar_totales(totales['suma'], totales['cantidad'])
+        self.save()
+    
+    @classmethod
+    def registrar_calificacion(cls, calificacion):
+        """
+        Ajusta de forma incremental el promedio de la inscripción tras crear una calificación.
+        
+        Debe llamarse dentro de la misma transacción que creó la calificación. Solo se toca la
+        fila de la inscripción afectada: si la calificación reemplaza a la final anterior del
+        examen (recuperación), se ajusta la suma; si es la primera del examen, se suma y cuenta.
+        """
+        anterior = CalificacionExamen.objects.filter(
+            examen_id=calificacion.examen_id,
+            inscripcion_id=calificacion.inscripcion_id,
+        ).exclude(pk=calificacion.pk).order_by(
+            Case(When(recuperacion__isnull=False, then=0), default=1),
+            '-fecha_completado',
+            '-id',
+        ).values_list('porcentaje', 'recuperacion_id').first()
         
-        if calificaciones_finales:
-            total_porcentajes = sum(float(cal.porcentaje) for cal in calificaciones_finales)
-            self.promedio_final = Decimal(total_porcentajes / len(calificaciones_finales))
+        if anterior and anterior[1] is not None and calificacion.recuperacion_id is None:
+            # Una calificación normal nunca reemplaza a una recuperación
+            return None
+        
+        promedio, created = cls.objects.select_for_update().get_or_create(
+            inscripcion_id=calificacion.inscripcion_id
+        )
+        if created:
+            # Primera vez: inicializar los acumulados desde las calificaciones existentes
+            promedio.calcular_promedio()
+            return promedio
+        
+        suma = promedio.suma_porcentajes + Decimal(calificacion.porcentaje)
+        cantidad = promedio.examenes_calificados
+        if anterior:
+            suma -= anterior[0]
         else:
-            self.promedio_final = Decimal(0)
+            cantidad += 1
         
-        # Aprobado si promedio >= 80%
-        self.aprobado = float(self.promedio_final) >= 80.0
-        self.save()
+        promedio._asignar_totales(suma, cantidad)
+        promedio.save()
+        return promedio
+    
+    @classmethod
+    def recalcular_promedios(cls, inscripciones, batch_size=500):
+        """
+        Recalcula en bloque los promedios de las inscripciones dadas (queryset).
+        
+        Usa una consulta de agregación por lote de alumnos y escribe los resultados con un upsert.
+        Sirve también para reparar los acumulados incrementales. Cada lote bloquea primero sus
+        inscripciones (el mismo bloqueo que toma `responder`), así que una calificación registrada
+        en paralelo se aplica antes de leer los totales o después de escribirlos, nunca se pierde.
+        Retorna un diccionario con el conteo de filas y la duración.
+        """
+        inicio = time.perf_counter()
+        inscripcion_ids = sorted(inscripciones.values_list('id', flat=True))
+        
+        creados = aprobados = 0
+        for desde in range(0, len(inscripcion_ids), batch_size):
+            lote = inscripcion_ids[desde:desde + batch_size]
+            with transaction.atomic():
+                # Bloqueo en orden de id, igual en todos los lotes, para no generar interbloqueos
+                lote = list(
+                    Inscripcion.objects.select_for_update().filter(id__in=lote).order_by('id').values_list('id', flat=True)
+                )
+                totales = {
+                    fila['inscripcion_id']: fila
+                    for fila in cls.calificaciones_finales(lote)
+                    .order_by()
+                    .values('inscripcion_id')
+                    .annotate(suma=Sum('porcentaje'), cantidad=Count('id'))
+                }
+                
+                filas = []
+                for inscripcion_id in lote:
+                    fila = cls(inscripcion_id=inscripcion_id)
+                    total = totales.get(inscripcion_id, {})
+                    fila._asignar_totales(total.get('suma'), total.get('cantidad'))
+                    filas.append(fila)
+                
+                existentes = cls.objects.filter(inscripcion_id__in=lote).count()
+                cls.objects.bulk_create(
+                    filas,
+                    batch_size=batch_size,
+                    update_conflicts=True,
+                    unique_fields=['inscripcion'],
+                    update_fields=['promedio_final', 'aprobado', 'suma_porcentajes', 'examenes_calificados', 'fecha_calculo'],
+                )
+            creados += len(filas) - existentes
+            aprobados += sum(1 for fila in filas if fila.aprobado)
+        
+        return {
+            'inscripciones': len(inscripcion_ids),
+            'creados': creados,
+            'actualizados': len(inscripcion_ids) - creados,
+            'aprobados': aprobados,
+            'duracion_ms': round((time.perf_counter() - inicio) * 1000, 2),
+        }
     
     def contar_recuperaciones_totales(self):
         """Cuenta el total de recuperaciones que ha hecho este estudiante en la promoción"""
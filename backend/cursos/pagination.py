@@ -0,0 +1,42 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class PaginacionCursor(CursorPagination):
+    """Paginación keyset: cada página cuesta lo mismo sin importar su profundidad y no ejecuta COUNT(*)"""
+    
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+
+class PaginacionNumeroOCursor(PageNumberPagination):
+    """
+    Paginación por número de página (por defecto) con modo keyset opcional por petición.
+    
+    El cliente activa el modo keyset con ?paginacion=cursor; los enlaces next/previous conservan
+    el parámetro. La vista define el orden con el atributo ordenamiento_cursor, que debe usar
+    columnas indexadas y terminar en un campo único (por ejemplo ('-fecha_completado', '-id')).
+    """
+    parametro_modo = 'paginacion'
+    
+    def usa_cursor(self, request):
+        return (
+            request.query_params.get(self.parametro_modo) == 'cursor'
+            or PaginacionCursor.cursor_query_param in request.query_params
+        )
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = None
+        if self.usa_cursor(request):
+            self.cursor = PaginacionCursor(ordering=getattr(view, 'ordenamiento_cursor', '-id'))
+            return self.cursor.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+    
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
+    
+    def get_paginated_response_schema(self, schema):
+        if getattr(self, 'cursor', None) is not None:
+            return self.cursor.get_paginated_response_schema(schema)
+        return super().get_paginated_response_schema(schema)
@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.db import transaction
+import os
+import re
 from .models import (
-    Curso, Promocion, Tema, Material, Inscripcion, 
+    Curso, Promocion, Tema, Material, SubidaMaterial, Inscripcion, 
     Asistencia, Pregunta, Examen, RespuestaExamen, RecuperacionExamen,
     CalificacionExamen, PromedioPromocion, Diploma
 )
@@ -33,15 +37,48 @@ class MaterialSerializer(serializers.ModelSerializer):
     class Meta:
         model = Material
         fields = '__all__'
-        read_only_fields = ['fecha_creacion']
+        read_only_fields = ['fecha_creacion', 'nombre_original']
     
     def get_nombre_archivo(self, obj):
         """Retorna el nombre del archivo original"""
         if obj.archivo:
-            return obj.archivo.name.split('/')[-1]  # Obtener solo el nombre del archivo
+            return obj.nombre_descarga
         return None
 
 
+class SubidaMaterialSerializer(serializers.ModelSerializer):
+    """Inicio y estado de una subida reanudable; `recibidos` indica desde dónde reanudar"""
+    
+    class Meta:
+        model = SubidaMaterial
+        fields = [
+            'id', 'tema', 'titulo', 'descripcion', 'nombre_original', 'tamano_total', 'sha256',
+            'recibidos', 'estado', 'material', 'fecha_creacion'
+        ]
+        read_only_fields = ['id', 'recibidos', 'estado', 'material', 'fecha_creacion']
+    
+    def validate_nombre_original(self, value):
+        nombre = os.path.basename(value.replace('\\', '/')).strip()
+        if not nombre:
+            raise serializers.ValidationError("El nombre del archivo no es válido")
+        return nombre
+    
+    def validate_tamano_total(self, value):
+        if value < 0:
+            raise serializers.ValidationError("El tamaño no puede ser negativo")
+        if value > settings.SUBIDAS_TAMANO_MAXIMO:
+            raise serializers.ValidationError(
+                f"El archivo supera el tamaño máximo permitido ({settings.SUBIDAS_TAMANO_MAXIMO} bytes)"
+            )
+        return value
+    
+    def validate_sha256(self, value):
+        value = value.lower()
+        if not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise serializers.ValidationError("Debe ser un SHA-256 en hexadecimal (64 caracteres)")
+        return value
+
+
 class TemaSerializer(serializers.ModelSerializer):
     materiales = MaterialSerializer(many=True, read_only=True)
     curso_nombre = serializers.CharField(source='curso.nombre', read_only=True)
@@ -87,6 +124,55 @@ class AsistenciaSerializer(serializers.ModelSerializer):
         return f"{obj.inscripcion.alumno.get_full_name() or obj.inscripcion.alumno.username}"
 
 
+class AsistenciaItemSerializer(serializers.Serializer):
+    """Asistencia de un alumno dentro de un registro masivo"""
+    inscripcion = serializers.IntegerField()
+    tipo_asistencia = serializers.ChoiceField(choices=Asistencia.TIPO_ASISTENCIA_CHOICES)
+    observaciones = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+class AsistenciaBulkSerializer(serializers.Serializer):
+    """Serializer para registrar (o actualizar) la asistencia de toda una clase en un tema"""
+    tema = serializers.PrimaryKeyRelatedField(queryset=Tema.objects.all())
+    asistencias = AsistenciaItemSerializer(many=True, allow_empty=False)
+    
+    def validate(self, attrs):
+        """Validar que cada alumno aparezca una vez y esté inscrito en el curso del tema (una sola consulta)"""
+        tema = attrs['tema']
+        ids = [item['inscripcion'] for item in attrs['asistencias']]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError({'asistencias': 'Cada inscripción debe aparecer una sola vez'})
+        
+        inscripciones = Inscripcion.objects.filter(promocion__curso_id=tema.curso_id).in_bulk(ids)
+        faltantes = [inscripcion_id for inscripcion_id in ids if inscripcion_id not in inscripciones]
+        if faltantes:
+            raise serializers.ValidationError({
+                'asistencias': f"Inscripciones inexistentes o de otro curso: {', '.join(str(i) for i in faltantes)}"
+            })
+        attrs['promocion_ids'] = {insc.promocion_id for insc in inscripciones.values()}
+        return attrs
+    
+    def create(self, validated_data):
+        """Insertar o actualizar todas las asistencias con un solo upsert sobre (inscripción, tema)"""
+        tema = validated_data['tema']
+        asistencias = [
+            Asistencia(
+                inscripcion_id=item['inscripcion'],
+                tema=tema,
+                tipo_asistencia=item['tipo_asistencia'],
+                observaciones=item.get('observaciones'),
+            )
+            for item in validated_data['asistencias']
+        ]
+        with transaction.atomic():
+            return Asistencia.objects.bulk_create(
+                asistencias,
+                update_conflicts=True,
+                unique_fields=['inscripcion', 'tema'],
+                update_fields=['tipo_asistencia', 'observaciones', 'fecha_actualizacion'],
+            )
+
+
 class PreguntaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pregunta
@@ -115,7 +201,11 @@ class ExamenSerializer(serializers.ModelSerializer):
     
     def get_cantidad_preguntas_disponibles(self, obj):
         """Retorna la cantidad de preguntas disponibles en el banco del tema"""
-        return obj.tema.preguntas.count()
+        # ExamenViewSet anota el conteo en el queryset para evitar una consulta por examen
+        cantidad = getattr(obj, 'cantidad_preguntas_banco', None)
+        if cantidad is None:
+            cantidad = obj.tema.preguntas.count()
+        return cantidad
 
 
 class ExamenListSerializer(serializers.ModelSerializer):
@@ -131,7 +221,11 @@ class ExamenListSerializer(serializers.ModelSerializer):
     
     def get_cantidad_preguntas_disponibles(self, obj):
         """Retorna la cantidad de preguntas disponibles en el banco del tema"""
-        return obj.tema.preguntas.count()
+        # ExamenViewSet anota el conteo en el queryset para evitar una consulta por examen
+        cantidad = getattr(obj, 'cantidad_preguntas_banco', None)
+        if cantidad is None:
+            cantidad = obj.tema.preguntas.count()
+        return cantidad
 
 
 class RespuestaExamenSerializer(serializers.ModelSerializer):
@@ -164,11 +258,9 @@ class RecuperacionExamenSerializer(serializers.ModelSerializer):
 
 class RecuperacionExamenBulkCreateSerializer(serializers.Serializer):
     """Serializer para crear múltiples recuperaciones a la vez"""
-    from .models import Examen, Inscripcion
-    
-    examen = serializers.PrimaryKeyRelatedField(queryset=Examen.objects.all())
+    examen = serializers.PrimaryKeyRelatedField(queryset=Examen.objects.select_related('tema'))
     inscripciones = serializers.ListField(
-        child=serializers.PrimaryKeyRelatedField(queryset=Inscripcion.objects.all()),
+        child=serializers.IntegerField(),
         min_length=1,
         help_text='Lista de IDs de inscripciones'
     )
@@ -177,24 +269,22 @@ class RecuperacionExamenBulkCreateSerializer(serializers.Serializer):
     activa = serializers.BooleanField(default=True)
     
     def validate_inscripciones(self, value):
-        """Validar que las inscripciones sean válidas y únicas"""
+        """Validar que las inscripciones sean válidas y únicas (una sola consulta para todas)"""
         if not value:
             raise serializers.ValidationError("Debe seleccionar al menos una inscripción")
         # Eliminar duplicados manteniendo el orden
-        seen = set()
-        unique_value = []
-        for item in value:
-            item_id = item.id if hasattr(item, 'id') else item
-            if item_id not in seen:
-                seen.add(item_id)
-                unique_value.append(item)
-        value = unique_value
+        ids = list(dict.fromkeys(value))
+        inscripciones = Inscripcion.objects.select_related('alumno', 'promocion').in_bulk(ids)
+        faltantes = [inscripcion_id for inscripcion_id in ids if inscripcion_id not in inscripciones]
+        if faltantes:
+            raise serializers.ValidationError(
+                f"Las siguientes inscripciones no existen: {', '.join(str(i) for i in faltantes)}"
+            )
+        value = [inscripciones[inscripcion_id] for inscripcion_id in ids]
         # Verificar que todas las inscripciones pertenezcan al mismo curso
-        if len(value) > 1:
-            # value ya contiene objetos Inscripcion
-            cursos = set(insc.promocion.curso_id for insc in value)
-            if len(cursos) > 1:
-                raise serializers.ValidationError("Todas las inscripciones deben ser del mismo curso")
+        cursos = set(insc.promocion.curso_id for insc in value)
+        if len(cursos) > 1:
+            raise serializers.ValidationError("Todas las inscripciones deben ser del mismo curso")
         return value
     
     def validate(self, attrs):
@@ -204,26 +294,21 @@ class RecuperacionExamenBulkCreateSerializer(serializers.Serializer):
         return attrs
     
     def create(self, validated_data):
-        """Crear múltiples recuperaciones"""
-        from .models import RecuperacionExamen
+        """Crear múltiples recuperaciones con un solo INSERT"""
         examen = validated_data['examen']
-        inscripciones = validated_data['inscripciones']
-        fecha_inicio = validated_data['fecha_inicio']
-        fecha_fin = validated_data['fecha_fin']
-        activa = validated_data.get('activa', True)
-        
-        recuperaciones = []
-        for inscripcion in inscripciones:
-            recuperacion = RecuperacionExamen.objects.create(
+        recuperaciones = [
+            RecuperacionExamen(
                 examen=examen,
                 inscripcion=inscripcion,
-                fecha_inicio=fecha_inicio,
-                fecha_fin=fecha_fin,
-                activa=activa
+                fecha_inicio=validated_data['fecha_inicio'],
+                fecha_fin=validated_data['fecha_fin'],
+                activa=validated_data.get('activa', True)
             )
-            recuperaciones.append(recuperacion)
+            for inscripcion in validated_data['inscripciones']
+        ]
         
-        return recuperaciones
+        with transaction.atomic():
+            return RecuperacionExamen.objects.bulk_create(recuperaciones)
 
 
 class CalificacionExamenSerializer(serializers.ModelSerializer):
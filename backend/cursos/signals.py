@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .almacenamiento import almacenamiento_materiales
+from .models import (
+    Promocion, Tema, Material, ArchivoMaterial, DerivadoArchivo, Inscripcion, Pregunta, RecuperacionExamen,
+    PromedioPromocion
+)
+
+
+@receiver(post_init, sender=Pregunta)
+def recordar_tema_pregunta(sender, instance, **kwargs):
+    """Guarda el tema original para invalidar también su caché si la pregunta cambia de tema"""
+    instance._tema_id_original = instance.tema_id
+
+
+@receiver(post_save, sender=Pregunta)
+@receiver(post_delete, sender=Pregunta)
+def invalidar_banco_preguntas(sender, instance, **kwargs):
+    """Invalida la lista cacheada de IDs del banco de preguntas al crear, editar o eliminar una pregunta"""
+    Tema.invalidar_ids_preguntas(instance.tema_id, getattr(instance, '_tema_id_original', None))
+    instance._tema_id_original = instance.tema_id
+
+
+@receiver(post_init, sender=Inscripcion)
+def recordar_alumno_inscripcion(sender, instance, **kwargs):
+    """Guarda el alumno original para invalidar también su alcance si la inscripción cambia de alumno"""
+    instance._alumno_id_original = instance.alumno_id
+
+
+@receiver(post_save, sender=Inscripcion)
+@receiver(post_delete, sender=Inscripcion)
+def invalidar_alcance_inscripcion(sender, instance, **kwargs):
+    """Invalida el alcance cacheado del alumno al crear, editar o eliminar una inscripción"""
+    Inscripcion.invalidar_alcance(instance.alumno_id, getattr(instance, '_alumno_id_original', None))
+    instance._alumno_id_original = instance.alumno_id
+
+
+@receiver(post_init, sender=Promocion)
+def recordar_curso_promocion(sender, instance, **kwargs):
+    """Guarda el curso original de la promoción para detectar cambios de curso"""
+    instance._curso_id_original = instance.curso_id
+
+
+@receiver(post_save, sender=Promocion)
+def invalidar_alcance_promocion(sender, instance, created, **kwargs):
+    """Si la promoción cambia de curso, invalida el alcance de todos sus alumnos"""
+    if not created and instance.curso_id != getattr(instance, '_curso_id_original', instance.curso_id):
+        Inscripcion.invalidar_alcance(*instance.inscripciones.values_list('alumno_id', flat=True))
+    instance._curso_id_original = instance.curso_id
+
+
+@receiver(post_delete, sender=RecuperacionExamen)
+def recalcular_promedio_recuperacion(sender, instance, **kwargs):
+    """
+    Al eliminar una recuperación se eliminan en cascada su calificación y sus respuestas: el
+    promedio incremental de la inscripción se recalcula desde las calificaciones que quedan
+    """
+    inscripcion_id = instance.inscripcion_id
+    
+    def recalcular():
+        # Si la inscripción también se eliminó (cascada), ya no hay promedio que corregir
+        inscripciones = Inscripcion.objects.filter(pk=inscripcion_id, promedio__isnull=False)
+        if inscripciones.exists():
+            PromedioPromocion.recalcular_promedios(inscripciones)
+    
+    transaction.on_commit(recalcular)
+
+
+@receiver(post_init, sender=Material)
+def recordar_archivo_material(sender, instance, **kwargs):
+    """Guarda el archivo original para mover la referencia si el material cambia de archivo"""
+    instance._archivo_original = instance.archivo.name
+
+
+@receiver(post_save, sender=Material)
+def actualizar_referencias_material(sender, instance, created, **kwargs):
+    """Cuenta las referencias a blobs del almacenamiento deduplicado al crear o cambiar el archivo"""
+    anterior = None if created else getattr(instance, '_archivo_original', None)
+    if instance.archivo.name != anterior:
+        ArchivoMaterial.registrar_referencia(instance.archivo.name)
+        ArchivoMaterial.liberar_referencia(anterior)
+    instance._archivo_original = instance.archivo.name
+
+
+@receiver(post_delete, sender=Material)
+def liberar_referencia_material(sender, instance, **kwargs):
+    """Libera la referencia al blob; si queda huérfano se borra del disco"""
+    ArchivoMaterial.liberar_referencia(instance.archivo.name)
+
+
+@receiver(post_save, sender=ArchivoMaterial)
+def encolar_derivados(sender, instance, created, **kwargs):
+    """Genera miniaturas y versiones comprimidas de cada contenido nuevo, en segundo plano"""
+    if created:
+        from .derivados import encolar
+        transaction.on_commit(lambda: encolar(instance.pk))
+
+
+@receiver(post_delete, sender=DerivadoArchivo)
+def borrar_archivo_derivado(sender, instance, **kwargs):
+    """Borra del disco el derivado (también cuando se elimina en cascada con su ArchivoMaterial)"""
+    almacenamiento_materiales.delete(instance.nombre)
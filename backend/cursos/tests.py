@@ -0,0 +1,249 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from elohimcoban.routers import EstadoReplica, ReplicaRouter, estado_peticion, replica_configurada
+from usuarios.models import Usuario
+
+from .descargas import parsear_rango
+from .models import (
+    Curso, Promocion, Tema, Inscripcion, Pregunta, Examen, RecuperacionExamen,
+    IntentoExamen, CalificacionExamen, PromedioPromocion
+)
+
+
+# Caché en memoria: los conteos de consultas no dependen del backend de caché configurado
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class ExamenListaConsultasTest(APITestCase):
+    """El listado de exámenes debe ejecutar la misma cantidad de consultas sin importar cuántos exámenes devuelva"""
+
+    def setUp(self):
+        self.docente = Usuario.objects.create_user('docente', password='x', tipo='docente')
+        self.alumno = Usuario.objects.create_user('alumno', password='x', tipo='alumno')
+        self.curso = Curso.objects.create(nombre='Curso')
+        promocion = Promocion.objects.create(
+            curso=self.curso, nombre='Promoción', fecha_inicio=date.today(), docente=self.docente
+        )
+        self.inscripcion = Inscripcion.objects.create(alumno=self.alumno, promocion=promocion)
+        self.temas = 0
+
+    def crear_examen(self):
+        """Examen con banco de preguntas, intento, calificación y recuperación del alumno"""
+        self.temas += 1
+        tema = Tema.objects.create(curso=self.curso, numero_tema=self.temas, titulo=f'Tema {self.temas}')
+        preguntas = [
+            Pregunta.objects.create(
+                tema=tema, pregunta_texto=f'Pregunta {numero}', tipo_pregunta='opcion_multiple',
+                respuesta_correcta='a'
+            )
+            for numero in range(3)
+        ]
+        examen = Examen.objects.create(tema=tema, numero_preguntas=3)
+        IntentoExamen.objects.create(
+            examen=examen, inscripcion=self.inscripcion, preguntas_ids=[pregunta.id for pregunta in preguntas]
+        )
+        CalificacionExamen.objects.create(
+            examen=examen, inscripcion=self.inscripcion, puntaje_obtenido=1, puntaje_total=3, porcentaje=33
+        )
+        RecuperacionExamen.objects.create(
+            examen=examen, inscripcion=self.inscripcion,
+            fecha_inicio=timezone.now(), fecha_fin=timezone.now() + timedelta(days=1)
+        )
+        return examen
+
+    def listar(self, usuario, consultas):
+        # Usuario recién cargado y caché vacía: cada petición parte del mismo estado
+        cache.clear()
+        self.client.force_authenticate(Usuario.objects.get(pk=usuario.pk))
+        with self.assertNumQueries(consultas):
+            response = self.client.get('/api/examenes/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_consultas_constantes_docente(self):
+        self.crear_examen()
+        resultados = self.listar(self.docente, 2)
+        self.assertEqual(len(resultados), 1)
+
+        for _ in range(9):
+            self.crear_examen()
+        resultados = self.listar(self.docente, 2)
+        self.assertEqual(len(resultados), 10)
+        self.assertTrue(all(examen['cantidad_preguntas_disponibles'] == 3 for examen in resultados))
+
+    def test_consultas_constantes_alumno(self):
+        self.crear_examen()
+        resultados = self.listar(self.alumno, 3)
+        self.assertEqual(len(resultados), 1)
+
+        for _ in range(9):
+            self.crear_examen()
+        resultados = self.listar(self.alumno, 3)
+        self.assertEqual(len(resultados), 10)
+        self.assertTrue(all(examen['cantidad_preguntas_disponibles'] == 3 for examen in resultados))
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PromedioIncrementalTest(APITestCase):
+    """El promedio incremental de `responder` debe coincidir con el recálculo completo"""
+
+    def setUp(self):
+        docente = Usuario.objects.create_user('docente', password='x', tipo='docente')
+        alumno = Usuario.objects.create_user('alumno', password='x', tipo='alumno')
+        curso = Curso.objects.create(nombre='Curso')
+        promocion = Promocion.objects.create(
+            curso=curso, nombre='Promoción', fecha_inicio=date.today(), docente=docente
+        )
+        self.inscripcion = Inscripcion.objects.create(alumno=alumno, promocion=promocion)
+        self.examenes = []
+        for numero in (1, 2):
+            tema = Tema.objects.create(curso=curso, numero_tema=numero, titulo=f'Tema {numero}')
+            for pregunta in range(4):
+                Pregunta.objects.create(
+                    tema=tema, pregunta_texto=f'Pregunta {pregunta}', tipo_pregunta='opcion_multiple',
+                    respuesta_correcta='a'
+                )
+            self.examenes.append(Examen.objects.create(tema=tema, numero_preguntas=4))
+        self.client.force_authenticate(alumno)
+
+    def rendir(self, examen, correctas, recuperacion=None):
+        parametros = {'recuperacion_id': recuperacion.id} if recuperacion else {}
+        response = self.client.get(f'/api/examenes/{examen.id}/preguntas/', parametros)
+        self.assertEqual(response.status_code, 200)
+        ids = [pregunta['id'] for pregunta in response.data['preguntas']]
+        cuerpo = {
+            'respuestas': [
+                {'pregunta_id': pregunta_id, 'respuesta': 'a' if indice < correctas else 'z'}
+                for indice, pregunta_id in enumerate(ids)
+            ]
+        }
+        if recuperacion:
+            cuerpo['recuperacion_id'] = recuperacion.id
+        response = self.client.post(f'/api/examenes/{examen.id}/responder/', cuerpo, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def totales(self):
+        promedio = PromedioPromocion.objects.get(inscripcion=self.inscripcion)
+        return promedio.suma_porcentajes, promedio.examenes_calificados, promedio.promedio_final, promedio.aprobado
+
+    def test_recuperacion_reemplaza_y_coincide_con_recalculo(self):
+        self.rendir(self.examenes[0], correctas=2)
+        self.rendir(self.examenes[1], correctas=4)
+        self.assertEqual(self.totales(), (Decimal('150.00'), 2, Decimal('75.00'), False))
+
+        recuperacion = RecuperacionExamen.objects.create(
+            examen=self.examenes[0], inscripcion=self.inscripcion,
+            fecha_inicio=timezone.now() - timedelta(hours=1), fecha_fin=timezone.now() + timedelta(hours=1)
+        )
+        self.rendir(self.examenes[0], correctas=3, recuperacion=recuperacion)
+        incremental = self.totales()
+        self.assertEqual(incremental, (Decimal('175.00'), 2, Decimal('87.50'), True))
+
+        # Acumulados corruptos: la reparación en bloque vuelve al mismo resultado
+        PromedioPromocion.objects.filter(inscripcion=self.inscripcion).update(
+            suma_porcentajes=0, examenes_calificados=0, promedio_final=0, aprobado=False
+        )
+        resultado = PromedioPromocion.recalcular_promedios(Inscripcion.objects.filter(pk=self.inscripcion.pk))
+        self.assertEqual(resultado['actualizados'], 1)
+        self.assertEqual(self.totales(), incremental)
+
+
+class ParsearRangoTest(SimpleTestCase):
+    def test_rango_simple(self):
+        self.assertEqual(parsear_rango('bytes=2-5', 10), (2, 5))
+
+    def test_fin_abierto_y_fin_mayor_al_tamano(self):
+        self.assertEqual(parsear_rango('bytes=4-', 10), (4, 9))
+        self.assertEqual(parsear_rango('bytes=8-100', 10), (8, 9))
+
+    def test_sufijo(self):
+        self.assertEqual(parsear_rango('bytes=-3', 10), (7, 9))
+        self.assertEqual(parsear_rango('bytes=-30', 10), (0, 9))
+        self.assertIs(parsear_rango('bytes=-0', 10), False)
+
+    def test_inicio_fuera_del_archivo_no_es_satisfacible(self):
+        self.assertIs(parsear_rango('bytes=10-20', 10), False)
+
+    def test_rangos_ignorados(self):
+        for encabezado in ('bytes=5-2', 'bytes=0-1,4-5', 'bytes=-', 'items=0-5', 'bytes=a-b'):
+            self.assertIsNone(parsear_rango(encabezado, 10), encabezado)
+
+
+class ReplicaRouterTest(SimpleTestCase):
+    """Solo los modelos de la aplicación se enrutan; la caché en base de datos no fija al usuario"""
+
+    def setUp(self):
+        self.estado = EstadoReplica()
+        self.estado.usar_replica = True
+        self.token = estado_peticion.set(self.estado)
+        self.router = ReplicaRouter()
+        self.entrada_cache = DatabaseCache('cache_pruebas', {}).cache_model_class
+
+    def tearDown(self):
+        estado_peticion.reset(self.token)
+
+    def test_lecturas_de_la_aplicacion_van_a_la_replica(self):
+        self.assertEqual(self.router.db_for_read(CalificacionExamen), settings.REPLICA_ALIAS)
+        self.assertEqual(self.router.db_for_read(Usuario), settings.REPLICA_ALIAS)
+
+    def test_modelos_de_django_no_se_enrutan(self):
+        for modelo in (self.entrada_cache, Session):
+            self.assertIsNone(self.router.db_for_read(modelo))
+            self.assertIsNone(self.router.db_for_write(modelo))
+        self.assertFalse(self.estado.escribio)
+
+    def test_escritura_vuelve_a_la_principal(self):
+        self.assertEqual(self.router.db_for_write(CalificacionExamen), DEFAULT_DB_ALIAS)
+        self.assertTrue(self.estado.escribio)
+        self.assertIsNone(self.router.db_for_read(CalificacionExamen))
+
+
+@skipUnless(replica_configurada(), 'Requiere DB_REPLICA_HOST o DB_REPLICA_NAME (espejo de la base de pruebas)')
+@override_settings(CACHES=CACHE_LOCAL)
+class ReplicaEspejoTest(APITransactionTestCase):
+    """
+    Con la réplica como espejo de la base de pruebas: los listados leen de la réplica salvo tras
+    escribir. Sin transacción envolvente para que la conexión de la réplica vea los datos.
+    """
+    databases = {DEFAULT_DB_ALIAS, settings.REPLICA_ALIAS} if replica_configurada() else {DEFAULT_DB_ALIAS}
+
+    def setUp(self):
+        cache.clear()
+        self.docente = Usuario.objects.create_user('docente', password='x', tipo='docente')
+        self.client.force_authenticate(self.docente)
+
+    def consultas_por_alias(self, peticion):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as principal, \
+                CaptureQueriesContext(connections[settings.REPLICA_ALIAS]) as replica:
+            response = peticion()
+        self.assertLess(response.status_code, 400)
+        return len(principal), len(replica)
+
+    def test_listado_lee_de_la_replica(self):
+        principal, replica = self.consultas_por_alias(lambda: self.client.get('/api/calificaciones/'))
+        self.assertEqual(principal, 0)
+        self.assertGreater(replica, 0)
+
+    def test_usuario_fijado_tras_escribir_lee_de_la_principal(self):
+        curso = Curso.objects.create(nombre='Curso')
+        response = self.client.post(
+            '/api/promociones/', {'curso': curso.id, 'nombre': 'P', 'fecha_inicio': date.today()}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+        principal, replica = self.consultas_por_alias(lambda: self.client.get('/api/calificaciones/'))
+        self.assertGreater(principal, 0)
+        self.assertEqual(replica, 0)
@@ -7,6 +7,7 @@ router.register(r'cursos', views.CursoViewSet)
 router.register(r'promociones', views.PromocionViewSet)
 router.register(r'temas', views.TemaViewSet)
 router.register(r'materiales', views.MaterialViewSet)
+router.register(r'subidas-materiales', views.SubidaMaterialViewSet)
 router.register(r'inscripciones', views.InscripcionViewSet)
 router.register(r'asistencias', views.AsistenciaViewSet)
 router.register(r'preguntas', views.PreguntaViewSet)
@@ -1,25 +1,47 @@
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from decimal import Decimal
+import csv
+import json
+import os
+import re
+import time
+
+from elohimcoban import metricas
+from elohimcoban.routers import LecturaReplicaMixin
 
 from .models import (
-    Curso, Promocion, Tema, Material, Inscripcion, 
+    Curso, Promocion, Tema, Material, SubidaMaterial, Inscripcion, 
     Asistencia, Pregunta, Examen, RespuestaExamen, RecuperacionExamen,
-    CalificacionExamen, PromedioPromocion, Diploma
+    IntentoExamen, CalificacionExamen, PromedioPromocion, Diploma, DerivadoArchivo
 )
+from .almacenamiento import almacenamiento_materiales
+from .derivados import VARIANTES_IMAGEN, elegir_codificacion
+from .descargas import servir_archivo
+from .pagination import PaginacionNumeroOCursor
 from .serializers import (
     CursoSerializer, PromocionSerializer, TemaSerializer, TemaListSerializer,
-    MaterialSerializer, InscripcionSerializer, AsistenciaSerializer,
+    MaterialSerializer, SubidaMaterialSerializer, InscripcionSerializer, AsistenciaSerializer, AsistenciaBulkSerializer,
     PreguntaSerializer, PreguntaDetailSerializer, ExamenSerializer, ExamenListSerializer,
     RespuestaExamenSerializer, RecuperacionExamenSerializer, RecuperacionExamenBulkCreateSerializer,
     CalificacionExamenSerializer, PromedioPromocionSerializer, DiplomaSerializer
 )
 
 
+class Echo:
+    """Objeto tipo archivo que retorna lo escrito, para generar CSV en streaming con csv.writer"""
+    def write(self, value):
+        return value
+
+
 class CursoViewSet(viewsets.ModelViewSet):
     queryset = Curso.objects.all()
     serializer_class = CursoSerializer
@@ -37,10 +59,8 @@ class PromocionViewSet(viewsets.ModelViewSet):
         
         # Alumnos solo ven promociones donde están inscritos
         if user.es_alumno:
-            inscripciones = Inscripcion.objects.filter(
-                alumno=user, activa=True
-            ).values_list('promocion_id', flat=True)
-            queryset = queryset.filter(id__in=inscripciones, activa=True)
+            alcance = Inscripcion.obtener_alcance(user)
+            queryset = queryset.filter(id__in=alcance['promocion_ids'], activa=True)
         
         # Docentes ven sus propias promociones
         elif user.es_docente and not user.is_superuser:
@@ -72,11 +92,8 @@ class TemaViewSet(viewsets.ModelViewSet):
         
         # Alumnos solo ven temas de cursos de promociones donde están inscritos
         if user.es_alumno:
-            inscripciones = Inscripcion.objects.filter(
-                alumno=user, activa=True
-            ).select_related('promocion__curso')
-            curso_ids = [insc.promocion.curso_id for insc in inscripciones]
-            queryset = queryset.filter(curso_id__in=curso_ids)
+            alcance = Inscripcion.obtener_alcance(user)
+            queryset = queryset.filter(curso_id__in=alcance['curso_ids'])
         
         # Filtrar por promoción: obtener el curso de la promoción
         promocion_id = self.request.query_params.get('promocion')
@@ -106,11 +123,8 @@ class MaterialViewSet(viewsets.ModelViewSet):
         
         # Alumnos solo ven materiales de temas de cursos donde están inscritos
         if user.es_alumno:
-            inscripciones = Inscripcion.objects.filter(
-                alumno=user, activa=True
-            ).select_related('promocion__curso')
-            curso_ids = [insc.promocion.curso_id for insc in inscripciones]
-            queryset = queryset.filter(tema__curso_id__in=curso_ids)
+            alcance = Inscripcion.obtener_alcance(user)
+            queryset = queryset.filter(tema__curso_id__in=alcance['curso_ids'])
         
         # Filtrar por tema si se proporciona
         tema_id = self.request.query_params.get('tema')
@@ -125,37 +139,175 @@ class MaterialViewSet(viewsets.ModelViewSet):
         
         # Si se solicita descargar el archivo (query param download=true)
         if request.query_params.get('download') == 'true' and instance.archivo:
-            from django.http import FileResponse
-            import os
-            from mimetypes import guess_type
-            from urllib.parse import quote
-            
             file_path = instance.archivo.path
+            hash_contenido = instance.hash_contenido
+            derivados = {}
+            if hash_contenido:
+                derivados = {
+                    derivado.variante: derivado
+                    for derivado in DerivadoArchivo.objects.select_related('archivo').filter(archivo__hash_contenido=hash_contenido)
+                }
+            
+            # Miniatura o vista previa (?variant=miniatura|vista_previa) en lugar del archivo completo
+            variante = request.query_params.get('variant')
+            if variante:
+                derivado = derivados.get(variante) if variante in VARIANTES_IMAGEN else None
+                ruta_derivado = almacenamiento_materiales.path(derivado.nombre) if derivado else None
+                if not ruta_derivado or not os.path.exists(ruta_derivado):
+                    return Response(
+                        {'error': 'La variante no está disponible'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                nombre = f'{os.path.splitext(instance.nombre_descarga)[0]}_{variante}.jpg'
+                return servir_archivo(request, ruta_derivado, nombre, f'{hash_contenido}-{variante}')
+            
+            # Versión precomprimida si el cliente la acepta (Accept-Encoding)
+            codificacion = elegir_codificacion(request.META.get('HTTP_ACCEPT_ENCODING'), derivados)
+            if codificacion:
+                ruta_derivado = almacenamiento_materiales.path(derivados[codificacion].nombre)
+                if os.path.exists(ruta_derivado):
+                    return servir_archivo(
+                        request, ruta_derivado, instance.nombre_descarga,
+                        f'{hash_contenido}-{codificacion}', content_encoding=codificacion
+                    )
+            
             if os.path.exists(file_path):
-                # Obtener el tipo de contenido basado en la extensión
-                content_type, _ = guess_type(file_path)
-                if not content_type:
-                    content_type = 'application/octet-stream'
-                
-                # Obtener el nombre del archivo original (sin la ruta)
-                filename = os.path.basename(instance.archivo.name)
-                
-                # Codificar el nombre del archivo para caracteres especiales
-                # Usar RFC 5987 encoding para nombres de archivo con caracteres especiales
-                filename_encoded = quote(filename, safe='')
-                
-                response = FileResponse(
-                    open(file_path, 'rb'),
-                    content_type=content_type
-                )
-                # Usar ambos formatos para máxima compatibilidad
-                response['Content-Disposition'] = f'attachment; filename="{filename}"; filename*=UTF-8\'\'{filename_encoded}'
-                return response
+                # Soporta Range (206), ETag/Last-Modified y respuestas 304
+                return servir_archivo(request, file_path, instance.nombre_descarga, hash_contenido)
         
         # Comportamiento normal: devolver el serializer
         return super().retrieve(request, *args, **kwargs)
 
 
+
+class SubidaMaterialViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet
+):
+    """
+    Subida reanudable de materiales grandes:
+    
+    1. POST /subidas-materiales/ con tema, titulo, nombre_original, tamano_total y sha256.
+    2. PUT /subidas-materiales/{id}/fragmento/ con los bytes crudos del fragmento y el encabezado
+       "Content-Range: bytes inicio-fin/total" (o ?offset=inicio). Se puede reanudar consultando
+       GET /subidas-materiales/{id}/ y continuando desde `recibidos`.
+    3. POST /subidas-materiales/{id}/finalizar/ verifica el checksum y crea el Material.
+    """
+    queryset = SubidaMaterial.objects.select_related('tema').all()
+    serializer_class = SubidaMaterialSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        # Cada usuario solo ve sus propias subidas
+        return super().get_queryset().filter(usuario=self.request.user)
+    
+    def create(self, request, *args, **kwargs):
+        user = request.user
+        if not (user.es_docente or user.is_superuser):
+            return Response(
+                {'error': 'Solo los docentes pueden subir materiales'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return super().create(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        serializer.save(usuario=self.request.user)
+    
+    def perform_destroy(self, instance):
+        instance.eliminar_temporal()
+        instance.delete()
+    
+    @action(detail=True, methods=['put'])
+    def fragmento(self, request, pk=None):
+        """Recibe un fragmento y lo escribe por bloques en el archivo temporal, sin cargarlo en memoria"""
+        subida = self.get_object()
+        
+        try:
+            longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            longitud = 0
+        if longitud <= 0:
+            return Response({'error': 'El fragmento está vacío'}, status=status.HTTP_400_BAD_REQUEST)
+        if longitud > settings.SUBIDAS_TAMANO_MAXIMO_FRAGMENTO:
+            return Response(
+                {'error': f'El fragmento supera {settings.SUBIDAS_TAMANO_MAXIMO_FRAGMENTO} bytes'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        content_range = request.META.get('HTTP_CONTENT_RANGE')
+        if content_range:
+            match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range.strip())
+            if not match or int(match.group(2)) - int(match.group(1)) + 1 != longitud:
+                return Response({'error': 'Content-Range no es válido'}, status=status.HTTP_400_BAD_REQUEST)
+            if match.group(3) != '*' and int(match.group(3)) != subida.tamano_total:
+                return Response(
+                    {'error': 'El total de Content-Range no coincide con el tamaño declarado'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            inicio = int(match.group(1))
+        else:
+            try:
+                inicio = int(request.query_params.get('offset', ''))
+            except ValueError:
+                return Response(
+                    {'error': 'Se requiere el encabezado Content-Range o el parámetro offset'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # Validación previa (sin bloqueo) para no recibir un fragmento que se va a rechazar
+        rechazo = self.rechazar_fragmento(subida, inicio, longitud)
+        if rechazo:
+            return rechazo
+        
+        # El cuerpo se recibe fuera de la transacción: un cliente lento no retiene la conexión
+        # a la base ni el bloqueo de la fila
+        try:
+            ruta_fragmento = subida.recibir_fragmento(request.stream, longitud)
+        except ValueError as e:
+            return Response({'error': str(e), 'recibidos': subida.recibidos}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            with transaction.atomic():
+                # Bloqueo breve: verificar de nuevo el offset y copiar el fragmento al archivo temporal
+                subida = SubidaMaterial.objects.select_for_update().get(pk=subida.pk)
+                rechazo = self.rechazar_fragmento(subida, inicio, longitud)
+                if rechazo:
+                    return rechazo
+                subida.escribir_fragmento(inicio, ruta_fragmento)
+        finally:
+            # Si se rechazó, el archivo temporal de la subida no se tocó
+            os.remove(ruta_fragmento)
+        
+        return Response({'recibidos': subida.recibidos, 'tamano_total': subida.tamano_total})
+    
+    @staticmethod
+    def rechazar_fragmento(subida, inicio, longitud):
+        """Respuesta de error si el fragmento no puede escribirse en la subida; None si es válido"""
+        if subida.estado != 'pendiente':
+            return Response({'error': 'La subida ya fue finalizada o se está finalizando'}, status=status.HTTP_409_CONFLICT)
+        if inicio > subida.recibidos:
+            return Response(
+                {'error': 'El fragmento deja un hueco; reanuda desde recibidos', 'recibidos': subida.recibidos},
+                status=status.HTTP_409_CONFLICT
+            )
+        if inicio + longitud > subida.tamano_total:
+            return Response(
+                {'error': 'El fragmento excede el tamaño declarado del archivo', 'recibidos': subida.recibidos},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
+    
+    @action(detail=True, methods=['post'])
+    def finalizar(self, request, pk=None):
+        """Verifica tamaño y SHA-256 y crea el Material con el archivo ensamblado"""
+        subida = self.get_object()
+        try:
+            material = subida.finalizar()
+        except ValueError as e:
+            return Response({'error': str(e), 'recibidos': subida.recibidos}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = MaterialSerializer(material, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 class InscripcionViewSet(viewsets.ModelViewSet):
     queryset = Inscripcion.objects.select_related('alumno', 'promocion', 'promocion__curso').all()
     serializer_class = InscripcionSerializer
@@ -177,10 +329,13 @@ class InscripcionViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class AsistenciaViewSet(viewsets.ModelViewSet):
+class AsistenciaViewSet(LecturaReplicaMixin, viewsets.ModelViewSet):
     queryset = Asistencia.objects.select_related('inscripcion', 'inscripcion__alumno', 'tema').all()
     serializer_class = AsistenciaSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaginacionNumeroOCursor
+    ordenamiento_cursor = '-id'
+    acciones_replica = ('list', 'retrieve', 'matriz')
     
     def get_queryset(self):
         user = self.request.user
@@ -196,6 +351,123 @@ class AsistenciaViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(tema_id=tema_id)
         
         return queryset
+    
+    @action(detail=False, methods=['post'])
+    def registrar_lista(self, request):
+        """Endpoint para registrar la asistencia de toda la clase de un tema en una sola petición"""
+        user = request.user
+        if not (user.es_docente or user.is_superuser):
+            return Response(
+                {'error': 'Solo los docentes pueden registrar asistencias'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = AsistenciaBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        
+        # Retornar la lista completa del tema para las promociones afectadas
+        asistencias = self.get_queryset().filter(
+            tema=serializer.validated_data['tema'],
+            inscripcion__promocion_id__in=serializer.validated_data['promocion_ids']
+        )
+        return Response(AsistenciaSerializer(asistencias, many=True).data)
+    
+    @action(detail=False, methods=['get'])
+    def matriz(self, request):
+        """
+        Reporte de asistencia de una promoción (alumnos × temas) con resúmenes por alumno y por tema.
+        
+        La respuesta se transmite en formato columnar: cada fila de la matriz es una lista de
+        índices en 'tipos' (o null si no hay registro), en el mismo orden que 'temas'.
+        """
+        user = request.user
+        if not (user.es_docente or user.is_superuser):
+            return Response(
+                {'error': 'Solo los docentes pueden ver el reporte de asistencia'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        promocion_id = request.query_params.get('promocion')
+        if not promocion_id:
+            return Response(
+                {'error': 'promocion es requerido'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        promocion = get_object_or_404(Promocion, id=promocion_id)
+        
+        temas = list(
+            Tema.objects.filter(curso_id=promocion.curso_id)
+            .order_by('numero_tema')
+            .values_list('id', 'numero_tema', 'titulo')
+        )
+        alumnos = list(
+            Inscripcion.objects.filter(promocion=promocion)
+            .order_by('alumno__last_name', 'alumno__first_name', 'alumno__username')
+            .values_list('id', 'alumno__first_name', 'alumno__last_name', 'alumno__username')
+        )
+        
+        tipos = [tipo for tipo, _ in Asistencia.TIPO_ASISTENCIA_CHOICES]
+        indice_tipo = {tipo: indice for indice, tipo in enumerate(tipos)}
+        indice_tema = {tema_id: indice for indice, (tema_id, _, _) in enumerate(temas)}
+        asistencias = Asistencia.objects.filter(inscripcion__promocion=promocion, tema__curso_id=promocion.curso_id)
+        
+        # Conteos por tipo con agregación condicional (una consulta por eje)
+        conteos = {tipo: Count('id', filter=Q(tipo_asistencia=tipo)) for tipo in tipos}
+        por_alumno = {
+            fila.pop('inscripcion_id'): fila
+            for fila in asistencias.order_by().values('inscripcion_id').annotate(**conteos)
+        }
+        por_tema = {
+            fila.pop('tema_id'): fila
+            for fila in asistencias.order_by().values('tema_id').annotate(**conteos)
+        }
+        
+        def resumen(ids, totales, posibles):
+            columnas = {tipo: [] for tipo in tipos}
+            columnas['tasa_asistencia'] = []
+            for id_ in ids:
+                fila = totales.get(id_, {})
+                for tipo in tipos:
+                    columnas[tipo].append(fila.get(tipo, 0))
+                asistio = sum(fila.get(tipo, 0) for tipo in tipos if tipo != 'no_asistio')
+                columnas['tasa_asistencia'].append(round(asistio * 100 / posibles, 2) if posibles else 0)
+            return columnas
+        
+        def generar():
+            encabezado = {
+                'promocion': promocion.id,
+                'tipos': tipos,
+                'temas': {
+                    'id': [tema[0] for tema in temas],
+                    'numero_tema': [tema[1] for tema in temas],
+                    'titulo': [tema[2] for tema in temas],
+                },
+                'alumnos': {
+                    'inscripcion_id': [alumno[0] for alumno in alumnos],
+                    'nombre': [f"{alumno[1]} {alumno[2]}".strip() or alumno[3] for alumno in alumnos],
+                },
+            }
+            yield json.dumps(encabezado, ensure_ascii=False, separators=(',', ':'))[:-1]
+            
+            # Matriz fila por fila, leyendo las asistencias con un cursor. El cursor del servidor
+            # se abre dentro de una transacción para que funcione detrás de un pooler en modo transacción
+            filas = {inscripcion_id: [None] * len(temas) for inscripcion_id, *_ in alumnos}
+            with transaction.atomic(using=asistencias.db):
+                for inscripcion_id, tema_id, tipo in asistencias.values_list('inscripcion_id', 'tema_id', 'tipo_asistencia').iterator(chunk_size=2000):
+                    filas[inscripcion_id][indice_tema[tema_id]] = indice_tipo[tipo]
+            yield ',"matriz":['
+            for indice, (inscripcion_id, *_) in enumerate(alumnos):
+                yield (',' if indice else '') + json.dumps(filas[inscripcion_id], separators=(',', ':'))
+            yield ']'
+            
+            resumenes = {
+                'resumen_alumnos': resumen([alumno[0] for alumno in alumnos], por_alumno, len(temas)),
+                'resumen_temas': resumen([tema[0] for tema in temas], por_tema, len(alumnos)),
+            }
+            yield ',' + json.dumps(resumenes, separators=(',', ':'))[1:]
+        
+        return StreamingHttpResponse(generar(), content_type='application/json')
 
 
 class PreguntaViewSet(viewsets.ModelViewSet):
@@ -227,11 +499,8 @@ class ExamenViewSet(viewsets.ModelViewSet):
         
         # Alumnos solo ven exámenes de temas de cursos donde están inscritos
         if user.es_alumno:
-            inscripciones = Inscripcion.objects.filter(
-                alumno=user, activa=True
-            ).select_related('promocion__curso')
-            curso_ids = [insc.promocion.curso_id for insc in inscripciones]
-            queryset = queryset.filter(tema__curso_id__in=curso_ids, activo=True)
+            alcance = Inscripcion.obtener_alcance(user)
+            queryset = queryset.filter(tema__curso_id__in=alcance['curso_ids'], activo=True)
             
             # Si no se está filtrando por tema específico, solo mostrar exámenes disponibles ahora
             tema_id = self.request.query_params.get('tema')
@@ -252,6 +521,21 @@ class ExamenViewSet(viewsets.ModelViewSet):
         if tema_id:
             queryset = queryset.filter(tema_id=tema_id)
         
+        # Tamaño del banco de preguntas en la misma consulta (evita un COUNT por examen serializado)
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.annotate(
+                cantidad_preguntas_banco=Coalesce(
+                    Subquery(
+                        Pregunta.objects.filter(tema_id=OuterRef('tema_id'))
+                        .order_by()
+                        .values('tema_id')
+                        .annotate(total=Count('id'))
+                        .values('total')
+                    ),
+                    0
+                )
+            )
+        
         return queryset
     
     @action(detail=True, methods=['get'])
@@ -337,16 +621,15 @@ class ExamenViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
         
-        # Obtener preguntas aleatorias
-        preguntas = examen.obtener_preguntas_aleatorias()
-        
-        if preguntas.count() < examen.numero_preguntas:
+        # Obtener las preguntas del intento: se sortean una sola vez y se reutilizan al recargar
+        intento = IntentoExamen.obtener_o_sortear(examen, inscripcion, recuperacion)
+        if intento is None:
             return Response(
                 {'error': f'No hay suficientes preguntas en el banco. Se requieren al menos {examen.numero_preguntas} preguntas'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        serializer = PreguntaDetailSerializer(preguntas, many=True)
+        serializer = PreguntaDetailSerializer(intento.obtener_preguntas(), many=True)
         
         return Response({
             'examen_id': examen.id,
@@ -426,34 +709,88 @@ class ExamenViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
+        # Las preguntas válidas son las que se sortearon para este intento
+        intento = IntentoExamen.objects.filter(
+            examen=examen,
+            inscripcion=inscripcion,
+            recuperacion=recuperacion
+        ).first()
+        
+        if not intento:
+            return Response(
+                {'error': 'Debes cargar las preguntas del examen antes de responder'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        intento.examen = examen
+        
+        # El examen cambió de número de preguntas después del sorteo: hay que volver a cargarlas
+        if len(intento.preguntas_ids) != examen.numero_preguntas:
+            return Response(
+                {'error': 'El examen fue modificado. Vuelve a cargar las preguntas antes de responder'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Procesar respuestas
         respuestas_data = request.data.get('respuestas', [])
         
-        if len(respuestas_data) != examen.numero_preguntas:
+        if not isinstance(respuestas_data, list) or len(respuestas_data) != len(intento.preguntas_ids):
             return Response(
-                {'error': f'Debes responder exactamente {examen.numero_preguntas} preguntas'},
+                {'error': f'Debes responder exactamente {len(intento.preguntas_ids)} preguntas'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        puntos_totales_obtenidos = 0
+        # Normalizar las respuestas y rechazar preguntas repetidas antes de tocar la base de datos
+        respuestas_por_pregunta = {}
         for respuesta_data in respuestas_data:
-            pregunta_id = respuesta_data.get('pregunta_id')
-            respuesta_dada = respuesta_data.get('respuesta', '')
-            
-            pregunta = get_object_or_404(Pregunta, id=pregunta_id, tema=examen.tema)
-            
-            # Verificar si la respuesta es correcta
-            es_correcta = False
-            if pregunta.tipo_pregunta == 'opcion_multiple':
-                es_correcta = respuesta_dada.lower().strip() == pregunta.respuesta_correcta.lower().strip()
-            elif pregunta.tipo_pregunta == 'verdadero_falso':
-                es_correcta = respuesta_dada.lower().strip() == pregunta.respuesta_correcta.lower().strip()
-            
-            puntos_obtenidos = Decimal(examen.puntos_por_pregunta) if es_correcta else Decimal(0)
-            puntos_totales_obtenidos += float(puntos_obtenidos)
-            
-            # Crear respuesta (con recuperación si aplica)
-            RespuestaExamen.objects.create(
+            try:
+                pregunta_id = int(respuesta_data.get('pregunta_id'))
+            except (AttributeError, TypeError, ValueError):
+                return Response(
+                    {'error': 'Cada respuesta debe incluir un pregunta_id válido'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if pregunta_id in respuestas_por_pregunta:
+                return Response(
+                    {'error': 'No puedes responder la misma pregunta más de una vez'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            respuesta = respuesta_data.get('respuesta')
+            if respuesta is None:
+                respuesta = ''
+            elif not isinstance(respuesta, str):
+                return Response(
+                    {'error': 'Cada respuesta debe ser un texto'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            respuestas_por_pregunta[pregunta_id] = respuesta
+        
+        if respuestas_por_pregunta.keys() != set(intento.preguntas_ids):
+            return Response(
+                {'error': 'Las preguntas respondidas no coinciden con las asignadas en este intento'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        inicio_calificacion = time.perf_counter()
+        
+        # Obtener todas las preguntas referenciadas en una sola consulta
+        preguntas = Pregunta.objects.filter(tema=examen.tema).in_bulk(list(respuestas_por_pregunta))
+        if len(preguntas) != len(respuestas_por_pregunta):
+            return Response(
+                {'error': 'Algunas preguntas no pertenecen a este examen'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Calificar en memoria
+        puntos_por_pregunta = Decimal(examen.puntos_por_pregunta)
+        respuestas = []
+        puntos_totales_obtenidos = Decimal(0)
+        for pregunta_id, respuesta_dada in respuestas_por_pregunta.items():
+            pregunta = preguntas[pregunta_id]
+            es_correcta = pregunta.es_respuesta_correcta(respuesta_dada)
+            puntos_obtenidos = puntos_por_pregunta if es_correcta else Decimal(0)
+            puntos_totales_obtenidos += puntos_obtenidos
+            respuestas.append(RespuestaExamen(
                 examen=examen,
                 inscripcion=inscripcion,
                 pregunta=pregunta,
@@ -461,31 +798,62 @@ class ExamenViewSet(viewsets.ModelViewSet):
                 respuesta_dada=respuesta_dada,
                 es_correcta=es_correcta,
                 puntos_obtenidos=puntos_obtenidos,
-            )
+            ))
         
-        # Calcular calificación final
-        calificacion = CalificacionExamen.objects.create(
-            examen=examen,
-            inscripcion=inscripcion,
-            recuperacion=recuperacion,
-            puntaje_obtenido=Decimal(puntos_totales_obtenidos),
-            puntaje_total=Decimal(examen.puntaje_total),
-            porcentaje=Decimal((puntos_totales_obtenidos / examen.puntaje_total) * 100) if examen.puntaje_total > 0 else Decimal(0),
-        )
+        # El puntaje máximo sale del sorteo guardado, no de la configuración actual del examen
+        puntaje_total = Decimal(intento.puntaje_total)
+        porcentaje = ((puntos_totales_obtenidos / puntaje_total) * 100).quantize(Decimal('0.01')) if puntaje_total > 0 else Decimal(0)
         
-        # Si es recuperación, marcarla como completada
-        if recuperacion:
-            recuperacion.completada = True
-            recuperacion.save()
+        with transaction.atomic():
+            # Bloquear la inscripción para serializar envíos concurrentes (reintentos, doble clic)
+            Inscripcion.objects.select_for_update().filter(pk=inscripcion.pk).first()
+            
+            # Volver a comprobar dentro de la transacción que no exista ya una calificación
+            ya_respondido = CalificacionExamen.objects.filter(examen=examen, inscripcion=inscripcion)
+            if recuperacion:
+                ya_respondido = ya_respondido.filter(recuperacion=recuperacion)
+            else:
+                ya_respondido = ya_respondido.filter(recuperacion__isnull=True)
+            
+            if ya_respondido.exists():
+                return Response(
+                    {'error': 'Ya has respondido esta recuperación' if recuperacion else 'Ya has respondido este examen'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            RespuestaExamen.objects.bulk_create(respuestas)
+            
+            # Calcular calificación final
+            calificacion = CalificacionExamen.objects.create(
+                examen=examen,
+                inscripcion=inscripcion,
+                recuperacion=recuperacion,
+                puntaje_obtenido=puntos_totales_obtenidos,
+                puntaje_total=puntaje_total,
+                porcentaje=porcentaje,
+            )
+            
+            # Si es recuperación, marcarla como completada
+            if recuperacion:
+                RecuperacionExamen.objects.filter(pk=recuperacion.pk).update(completada=True)
+                recuperacion.completada = True
+            
+            # Mantener al día el promedio de la inscripción sin recalcular toda la promoción
+            PromedioPromocion.registrar_calificacion(calificacion)
+        
+        metricas.CALIFICACION_DURACION.observe(time.perf_counter() - inicio_calificacion)
+        metricas.EXAMENES_RESPONDIDOS.inc(tipo='recuperacion' if recuperacion else 'normal')
         
         serializer = CalificacionExamenSerializer(calificacion)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class RecuperacionExamenViewSet(viewsets.ModelViewSet):
-    queryset = RecuperacionExamen.objects.select_related('examen', 'inscripcion', 'inscripcion__alumno').all()
+    queryset = RecuperacionExamen.objects.select_related('examen', 'examen__tema', 'inscripcion', 'inscripcion__alumno').all()
     serializer_class = RecuperacionExamenSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaginacionNumeroOCursor
+    ordenamiento_cursor = '-id'
     
     def get_queryset(self):
         user = self.request.user
@@ -505,8 +873,22 @@ class RecuperacionExamenViewSet(viewsets.ModelViewSet):
         if user.es_alumno:
             queryset = queryset.filter(inscripcion__alumno=user)
         
+        # Número de recuperación calculado una sola vez para todo el listado.
+        # Los filtros anteriores conservan particiones completas (examen, inscripción), por lo que
+        # el ordinal coincide con numero_recuperacion; no se usa en detalle ni con paginación keyset
+        # porque filtrar por pk o por la posición del cursor alteraría la ventana.
+        if self.action == 'list' and not self.paginator.usa_cursor(self.request):
+            queryset = queryset.annotate(orden_recuperacion=RecuperacionExamen.ventana_numero_recuperacion())
+        
         return queryset
     
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None and self.paginator.usa_cursor(self.request):
+            # Con keyset el ordinal se calcula para la página con una sola consulta
+            RecuperacionExamen.asignar_numeros_recuperacion(page)
+        return page
+    
     def get_serializer_class(self):
         """Usar el serializer de creación múltiple si se envía una lista de inscripciones"""
         if self.action == 'create' and 'inscripciones' in self.request.data:
@@ -518,7 +900,6 @@ class RecuperacionExamenViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             # Solo docentes/admin pueden crear/editar recuperaciones
-            from rest_framework.permissions import IsAuthenticated
             return [IsAuthenticated()]
         return [IsAuthenticated()]
     
@@ -534,7 +915,7 @@ class RecuperacionExamenViewSet(viewsets.ModelViewSet):
             # Creación múltiple
             serializer = RecuperacionExamenBulkCreateSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            recuperaciones = serializer.save()
+            recuperaciones = RecuperacionExamen.asignar_numeros_recuperacion(serializer.save())
             
             # Retornar las recuperaciones creadas
             response_serializer = RecuperacionExamenSerializer(recuperaciones, many=True)
@@ -577,10 +958,13 @@ class RecuperacionExamenViewSet(viewsets.ModelViewSet):
         })
 
 
-class CalificacionExamenViewSet(viewsets.ReadOnlyModelViewSet):
+class CalificacionExamenViewSet(LecturaReplicaMixin, viewsets.ReadOnlyModelViewSet):
     queryset = CalificacionExamen.objects.select_related('examen', 'inscripcion', 'inscripcion__alumno').all()
     serializer_class = CalificacionExamenSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaginacionNumeroOCursor
+    ordenamiento_cursor = ('-fecha_completado', '-id')
+    acciones_replica = ('list', 'retrieve', 'exportar')
     
     def get_queryset(self):
         user = self.request.user
@@ -596,9 +980,87 @@ class CalificacionExamenViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(examen_id=examen_id)
         
         return queryset
+    
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """
+        Exporta en CSV el libro de calificaciones de una promoción: una fila por alumno y, por cada
+        examen del curso, la calificación normal y la de la última recuperación, más el promedio final.
+        
+        Se transmite fila por fila recorriendo inscripciones y calificaciones con cursores del lado
+        del servidor, por lo que la memoria no crece con el tamaño de la promoción.
+        """
+        user = request.user
+        if not (user.es_docente or user.is_superuser):
+            return Response(
+                {'error': 'Solo los docentes pueden exportar calificaciones'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        promocion_id = request.query_params.get('promocion')
+        if not promocion_id:
+            return Response(
+                {'error': 'promocion es requerido'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        promocion = get_object_or_404(Promocion, id=promocion_id)
+        
+        examenes = list(
+            Examen.objects.filter(tema__curso_id=promocion.curso_id)
+            .order_by('tema__numero_tema')
+            .values_list('id', 'tema__numero_tema', 'tema__titulo')
+        )
+        inscripciones = (
+            Inscripcion.objects.filter(promocion=promocion)
+            .order_by('id')
+            .values_list(
+                'id', 'alumno__username', 'alumno__first_name', 'alumno__last_name',
+                'promedio__promedio_final', 'promedio__aprobado'
+            )
+        )
+        calificaciones = (
+            CalificacionExamen.objects.filter(inscripcion__promocion=promocion, examen__tema__curso_id=promocion.curso_id)
+            .order_by('inscripcion_id', 'fecha_completado', 'id')
+            .values_list('inscripcion_id', 'examen_id', 'recuperacion_id', 'porcentaje')
+        )
+        chunk_size = 2000
+        
+        def generar():
+            writer = csv.writer(Echo())
+            encabezado = ['Usuario', 'Nombre']
+            for _, numero_tema, titulo in examenes:
+                encabezado += [f'Tema {numero_tema}: {titulo}', f'Tema {numero_tema}: {titulo} (recuperación)']
+            encabezado += ['Promedio final', 'Aprobado']
+            # BOM para que Excel reconozca la codificación UTF-8
+            yield '\ufeff' + writer.writerow(encabezado)
+            
+            # Ambos cursores vienen ordenados por inscripción: se recorren en paralelo (merge join).
+            # Los cursores del servidor viven dentro de una transacción para que funcionen detrás
+            # de un pooler en modo transacción
+            with transaction.atomic(using=calificaciones.db):
+                pendientes = calificaciones.iterator(chunk_size=chunk_size)
+                actual = next(pendientes, None)
+                for inscripcion_id, username, first_name, last_name, promedio, aprobado in inscripciones.iterator(chunk_size=chunk_size):
+                    normales, recuperaciones = {}, {}
+                    while actual is not None and actual[0] <= inscripcion_id:
+                        if actual[0] == inscripcion_id:
+                            _, examen_id, recuperacion_id, porcentaje = actual
+                            # Orden por fecha: la última recuperación sobrescribe a las anteriores
+                            (recuperaciones if recuperacion_id else normales)[examen_id] = porcentaje
+                        actual = next(pendientes, None)
+                    
+                    fila = [username, f'{first_name} {last_name}'.strip()]
+                    for examen_id, _, _ in examenes:
+                        fila += [normales.get(examen_id, ''), recuperaciones.get(examen_id, '')]
+                    fila += ['' if promedio is None else promedio, 'Sí' if aprobado else 'No']
+                    yield writer.writerow(fila)
+        
+        response = StreamingHttpResponse(generar(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="calificaciones_promocion_{promocion.id}.csv"'
+        return response
 
 
-class PromedioPromocionViewSet(viewsets.ReadOnlyModelViewSet):
+class PromedioPromocionViewSet(LecturaReplicaMixin, viewsets.ReadOnlyModelViewSet):
     queryset = PromedioPromocion.objects.select_related('inscripcion', 'inscripcion__alumno', 'inscripcion__promocion').all()
     serializer_class = PromedioPromocionSerializer
     permission_classes = [IsAuthenticated]
@@ -620,7 +1082,7 @@ class PromedioPromocionViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['post'])
     def calcular_promedios(self, request):
-        """Endpoint para calcular promedios de una promoción"""
+        """Endpoint para recalcular (y reparar) todos los promedios de una promoción"""
         promocion_id = request.data.get('promocion_id')
         if not promocion_id:
             return Response(
@@ -628,16 +1090,10 @@ class PromedioPromocionViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        from .models import Inscripcion
         inscripciones = Inscripcion.objects.filter(promocion_id=promocion_id, activa=True)
+        resultado = PromedioPromocion.recalcular_promedios(inscripciones)
         
-        for inscripcion in inscripciones:
-            promedio, created = PromedioPromocion.objects.get_or_create(
-                inscripcion=inscripcion
-            )
-            promedio.calcular_promedio()
-        
-        return Response({'mensaje': 'Promedios calculados correctamente'})
+        return Response({'mensaje': 'Promedios calculados correctamente', **resultado})
 
 
 class DiplomaViewSet(viewsets.ModelViewSet):
@@ -0,0 +1,288 @@
+"""
+Métricas de la API en formato de exposición de texto de Prometheus.
+
+Los valores se acumulan en memoria en cada proceso. Con varios workers de gunicorn se define
+METRICAS_DIRECTORIO: cada proceso vuelca periódicamente su estado a un archivo propio
+(metricas_<pid>.json) y /metrics suma los archivos de todos los procesos. El directorio debe
+vaciarse al iniciar el despliegue, igual que en el modo multiproceso de prometheus_client.
+"""
+
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LIMITES_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.valores = {}
+
+    def clave(self, etiquetas):
+        return tuple(str(etiquetas.get(nombre, '')) for nombre in self.etiquetas)
+
+    def formatear_etiquetas(self, clave, extra=()):
+        pares = list(zip(self.etiquetas, clave)) + list(extra)
+        if not pares:
+            return ''
+        texto = ','.join(
+            '{}="{}"'.format(nombre, valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for nombre, valor in pares
+        )
+        return '{' + texto + '}'
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self.clave(etiquetas)
+        with registro.lock:
+            self.valores[clave] = self.valores.get(clave, 0) + valor
+        registro.volcar_si_corresponde()
+
+    @staticmethod
+    def combinar(actual, nuevo):
+        return actual + nuevo
+
+    def exponer(self, valores):
+        for clave, valor in sorted(valores.items()):
+            yield f'{self.nombre}{self.formatear_etiquetas(clave)} {valor}'
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_DURACION):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(limites)
+
+    def observe(self, valor, **etiquetas):
+        clave = self.clave(etiquetas)
+        with registro.lock:
+            # [conteo por cubeta..., +Inf, suma]
+            celdas = self.valores.get(clave)
+            if celdas is None:
+                celdas = self.valores[clave] = [0] * (len(self.limites) + 1) + [0.0]
+            for indice, limite in enumerate(self.limites):
+                if valor <= limite:
+                    break
+            else:
+                indice = len(self.limites)
+            celdas[indice] += 1
+            celdas[-1] += valor
+        registro.volcar_si_corresponde()
+
+    @staticmethod
+    def combinar(actual, nuevo):
+        return [a + b for a, b in zip(actual, nuevo)]
+
+    def exponer(self, valores):
+        for clave, celdas in sorted(valores.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.limites + ('+Inf',), celdas):
+                acumulado += conteo
+                etiquetas = self.formatear_etiquetas(clave, [('le', str(limite))])
+                yield f'{self.nombre}_bucket{etiquetas} {acumulado}'
+            etiquetas = self.formatear_etiquetas(clave)
+            yield f'{self.nombre}_sum{etiquetas} {celdas[-1]}'
+            yield f'{self.nombre}_count{etiquetas} {acumulado}'
+
+
+class UsuariosActivos(Metrica):
+    """Usuarios distintos autenticados en los últimos METRICAS_VENTANA_ACTIVOS segundos"""
+    tipo = 'gauge'
+
+    def registrar(self, usuario_id):
+        ahora = time.time()
+        clave = (str(usuario_id),)
+        with registro.lock:
+            # Solo se reescribe la marca una vez por segundo para no tocar el diccionario en cada petición
+            if ahora - self.valores.get(clave, 0) >= 1:
+                self.valores[clave] = ahora
+        registro.volcar_si_corresponde()
+
+    @staticmethod
+    def combinar(actual, nuevo):
+        return max(actual, nuevo)
+
+    def depurar(self):
+        limite = time.time() - settings.METRICAS_VENTANA_ACTIVOS
+        for clave in [clave for clave, visto in self.valores.items() if visto < limite]:
+            del self.valores[clave]
+
+    def exponer(self, valores):
+        limite = time.time() - settings.METRICAS_VENTANA_ACTIVOS
+        activos = sum(1 for visto in valores.values() if visto >= limite)
+        yield f'{self.nombre} {activos}'
+
+
+class Registro:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Serializa la escritura del archivo del proceso entre hilos
+        self.lock_volcado = threading.Lock()
+        self.metricas = {}
+        self.ultimo_volcado = 0.0
+        self.pid_cargado = None
+
+    def agregar(self, metrica):
+        self.metricas[metrica.nombre] = metrica
+        return metrica
+
+    @property
+    def directorio(self):
+        return getattr(settings, 'METRICAS_DIRECTORIO', '')
+
+    def archivo_proceso(self):
+        return Path(self.directorio) / f'metricas_{os.getpid()}.json'
+
+    def estado(self):
+        """Copia serializable de los valores de todas las métricas de este proceso"""
+        with self.lock:
+            for metrica in self.metricas.values():
+                if isinstance(metrica, UsuariosActivos):
+                    metrica.depurar()
+            return {
+                nombre: [[list(clave), valor] for clave, valor in metrica.valores.items()]
+                for nombre, metrica in self.metricas.items()
+            }
+
+    def volcar_si_corresponde(self):
+        if not self.directorio or time.monotonic() - self.ultimo_volcado < settings.METRICAS_INTERVALO_VOLCADO:
+            return
+        # Si otro hilo ya está volcando no se espera: estos valores salen en el próximo volcado
+        if self.lock_volcado.acquire(blocking=False):
+            try:
+                self.volcar()
+            finally:
+                self.lock_volcado.release()
+
+    def volcar(self):
+        """
+        Escribe el estado de este proceso en su archivo de forma atómica. Llamar con lock_volcado
+        tomado. Los errores de disco solo se registran: las métricas nunca hacen fallar una petición.
+        """
+        self.ultimo_volcado = time.monotonic()
+        try:
+            self.escribir_archivo()
+        except OSError:
+            logger.warning('No se pudieron volcar las métricas en %s', self.directorio, exc_info=True)
+
+    def escribir_archivo(self):
+        archivo = self.archivo_proceso()
+        if self.pid_cargado != os.getpid():
+            # Primer volcado del proceso: si el PID se reutilizó tras reiniciar un worker, sumar lo
+            # que dejó el proceso anterior para que los contadores no retrocedan
+            self.pid_cargado = os.getpid()
+            if archivo.exists():
+                anterior = self.leer(archivo)
+                with self.lock:
+                    self.combinar(anterior, destino={
+                        nombre: metrica.valores for nombre, metrica in self.metricas.items()
+                    })
+        archivo.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=archivo.parent, prefix=f'{archivo.stem}.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as salida:
+                json.dump(self.estado(), salida)
+            os.replace(temporal, archivo)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+    @staticmethod
+    def leer(archivo):
+        try:
+            return json.loads(archivo.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    def combinar(self, estado, destino):
+        for nombre, filas in estado.items():
+            metrica = self.metricas.get(nombre)
+            if metrica is None:
+                continue
+            valores = destino.setdefault(nombre, {})
+            for clave, valor in filas:
+                clave = tuple(clave)
+                valores[clave] = metrica.combinar(valores[clave], valor) if clave in valores else valor
+        return destino
+
+    def valores_combinados(self):
+        if not self.directorio:
+            estado = self.estado()
+            return self.combinar(estado, destino={})
+        with self.lock_volcado:
+            self.volcar()
+        destino = {}
+        for archivo in sorted(Path(self.directorio).glob('metricas_*.json')):
+            self.combinar(self.leer(archivo), destino)
+        return destino
+
+    def exponer(self):
+        valores = self.valores_combinados()
+        lineas = []
+        for nombre, metrica in self.metricas.items():
+            lineas.append(f'# HELP {nombre} {metrica.ayuda}')
+            lineas.append(f'# TYPE {nombre} {metrica.tipo}')
+            lineas.extend(metrica.exponer(valores.get(nombre, {})))
+        return '\n'.join(lineas) + '\n'
+
+
+registro = Registro()
+
+PETICION_DURACION = registro.agregar(Histograma(
+    'elohim_peticion_duracion_segundos', 'Duración de las peticiones HTTP por vista (ViewSet.accion)',
+    etiquetas=('vista', 'metodo'),
+))
+PETICION_CONSULTAS = registro.agregar(Histograma(
+    'elohim_peticion_consultas', 'Consultas SQL ejecutadas por petición',
+    etiquetas=('vista',), limites=LIMITES_CONSULTAS,
+))
+EXAMENES_RESPONDIDOS = registro.agregar(Contador(
+    'elohim_examenes_respondidos_total', 'Exámenes y recuperaciones respondidos',
+    etiquetas=('tipo',),
+))
+CALIFICACION_DURACION = registro.agregar(Histograma(
+    'elohim_calificacion_duracion_segundos', 'Tiempo de calificar y guardar un examen respondido',
+))
+DESCARGA_BYTES = registro.agregar(Contador(
+    'elohim_descarga_bytes_total', 'Bytes de archivos de materiales servidos',
+))
+USUARIOS_ACTIVOS = registro.agregar(UsuariosActivos(
+    'elohim_usuarios_activos', 'Usuarios autenticados con actividad reciente',
+))
+
+
+def vista_metricas(request):
+    """
+    Expone las métricas. Si METRICAS_TOKEN está definido se exige "Authorization: Bearer <token>";
+    sin token solo se exponen con DEBUG activo.
+    """
+    token = settings.METRICAS_TOKEN
+    if token:
+        autorizacion = request.META.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(autorizacion, f'Bearer {token}'):
+            return HttpResponse('No autorizado\n', status=401, content_type=CONTENT_TYPE)
+    elif not settings.DEBUG:
+        raise Http404
+    return HttpResponse(registro.exponer(), content_type=CONTENT_TYPE)
@@ -0,0 +1,179 @@
+"""
+Middleware de instrumentación de rendimiento por petición.
+"""
+
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metricas
+
+logger = logging.getLogger('elohimcoban.rendimiento')
+
+# Listas de parámetros de longitud variable ("IN (%s, %s, ...)") se colapsan para que
+# consultas equivalentes con distinta cantidad de IDs compartan la misma huella
+PARAMETROS_REPETIDOS = re.compile(r'%s(?:\s*,\s*%s)+')
+
+# Lo mismo para las filas de un INSERT de varias filas ("VALUES (%s, %s), (%s, %s), ...")
+TUPLAS_REPETIDAS = re.compile(r'(\([^()]*\))(?:\s*,\s*\1)+')
+
+# Caracteres de SQL que se escriben en el log por consulta (un bulk_create puede medir megabytes)
+LONGITUD_MAXIMA_SQL = 1000
+
+
+def huella_sql(sql):
+    """Normaliza una consulta parametrizada para agrupar repeticiones (detección de N+1)"""
+    return TUPLAS_REPETIDAS.sub(r'\1, ...', PARAMETROS_REPETIDOS.sub('%s, ...', sql))
+
+
+def recortar_sql(sql):
+    if sql is None or len(sql) <= LONGITUD_MAXIMA_SQL:
+        return sql
+    return f'{sql[:LONGITUD_MAXIMA_SQL]}... [{len(sql)} caracteres]'
+
+
+def nombre_vista(request):
+    """
+    Nombre legible de la vista que atendió la petición. Para viewsets de DRF retorna
+    "ViewSet.accion" (por ejemplo "ExamenViewSet.responder"); si no, el nombre de la ruta.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    cls = getattr(match.func, 'cls', None)
+    acciones = getattr(match.func, 'actions', None)
+    if cls is not None and acciones:
+        accion = acciones.get(request.method.lower())
+        if accion:
+            return f'{cls.__name__}.{accion}'
+    if cls is not None:
+        return cls.__name__
+    return match.view_name or getattr(match.func, '__name__', None)
+
+
+class RegistroConsultas:
+    """Wrapper de ejecución que mide cada consulta enviada a la base de datos"""
+
+    def __init__(self):
+        self.cantidad = 0
+        self.duracion = 0.0
+        self.mas_lenta = (0.0, None)
+        self.huellas = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.cantidad += 1
+            self.duracion += duracion
+            self.huellas[huella_sql(sql)] += 1
+            if duracion > self.mas_lenta[0]:
+                self.mas_lenta = (duracion, sql)
+
+    def duplicadas(self, umbral):
+        """Huellas ejecutadas al menos `umbral` veces, de mayor a menor repetición"""
+        return [(sql, veces) for sql, veces in self.huellas.most_common() if veces >= umbral]
+
+
+class RendimientoMiddleware:
+    """
+    Registra, para una muestra de las peticiones (RENDIMIENTO_MUESTREO), la cantidad de consultas,
+    el tiempo total en base de datos, la consulta más lenta, las consultas repetidas y la vista.
+    Los datos se exponen en el encabezado Server-Timing y en una línea JSON del logger
+    "elohimcoban.rendimiento". En respuestas con streaming solo se mide hasta que se
+    retorna la respuesta, no la generación del contenido.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.muestreo = getattr(settings, 'RENDIMIENTO_MUESTREO', 0.0)
+        self.umbral_duplicadas = getattr(settings, 'RENDIMIENTO_UMBRAL_DUPLICADAS', 3)
+
+    def __call__(self, request):
+        if self.muestreo <= 0 or random.random() >= self.muestreo:
+            return self.get_response(request)
+
+        registro = RegistroConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(registro))
+            response = self.get_response(request)
+        total = time.perf_counter() - inicio
+
+        vista = nombre_vista(request)
+        duplicadas = registro.duplicadas(self.umbral_duplicadas)
+
+        entradas = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={registro.duracion * 1000:.1f};desc="{registro.cantidad} consultas"',
+        ]
+        if duplicadas:
+            entradas.append(f'dup;desc="{len(duplicadas)} consultas repetidas (max {duplicadas[0][1]})"')
+        response['Server-Timing'] = ', '.join(entradas)
+
+        logger.info(json.dumps({
+            'metodo': request.method,
+            'ruta': request.path,
+            'vista': vista,
+            'estado': response.status_code,
+            'duracion_ms': round(total * 1000, 2),
+            'consultas': registro.cantidad,
+            'db_ms': round(registro.duracion * 1000, 2),
+            'consulta_mas_lenta_ms': round(registro.mas_lenta[0] * 1000, 2),
+            'consulta_mas_lenta': recortar_sql(registro.mas_lenta[1]),
+            'duplicadas': [{'sql': recortar_sql(sql), 'veces': veces} for sql, veces in duplicadas[:5]],
+        }, ensure_ascii=False))
+        return response
+
+
+class ContadorConsultas:
+    """Wrapper de ejecución mínimo: solo cuenta consultas, para instrumentar todas las peticiones"""
+
+    def __init__(self):
+        self.cantidad = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.cantidad += 1
+        return execute(sql, params, many, context)
+
+
+class MetricasMiddleware:
+    """
+    Alimenta las métricas de elohimcoban.metricas: duración y consultas por vista y
+    usuarios autenticados activos. Las peticiones a /metrics no se registran.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == '/metrics':
+            return self.get_response(request)
+
+        contador = ContadorConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(contador))
+            response = self.get_response(request)
+        duracion = time.perf_counter() - inicio
+
+        vista = nombre_vista(request) or 'sin_ruta'
+        metricas.PETICION_DURACION.observe(duracion, vista=vista, metodo=request.method)
+        metricas.PETICION_CONSULTAS.observe(contador.cantidad, vista=vista)
+
+        # DRF asigna el usuario autenticado por JWT también al HttpRequest original
+        usuario = getattr(request, 'user', None)
+        if usuario is not None and usuario.is_authenticated:
+            metricas.USUARIOS_ACTIVOS.registrar(usuario.pk)
+        return response
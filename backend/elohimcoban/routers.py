@@ -0,0 +1,130 @@
+"""
+Enrutamiento de lecturas hacia una réplica de solo lectura.
+
+Las lecturas van a la réplica solo cuando una vista lo permite (LecturaReplicaMixin) para la
+petición en curso. Las escrituras siempre van a la base principal; después de escribir, el
+resto de la petición y las peticiones del mismo usuario durante REPLICA_FIJAR_SEGUNDOS leen de
+la principal para no ver datos atrasados por el retraso de replicación. Esa marca se guarda en la
+caché, que por eso debe ser compartida entre workers (verificado por un system check).
+"""
+
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Error, register
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+estado_peticion = ContextVar('estado_replica', default=None)
+
+# Apps cuyos modelos se enrutan. Los demás (caché en base de datos, sesiones, admin, etc.) usan
+# siempre la principal y no cuentan como escritura del usuario
+APPS_ENRUTADAS = ('cursos', 'usuarios')
+
+# Backends de caché que no comparten datos entre procesos
+CACHES_POR_PROCESO = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class EstadoReplica:
+    """Decisión de enrutamiento de la petición en curso"""
+
+    def __init__(self):
+        self.usar_replica = False
+        self.escribio = False
+
+
+def replica_configurada():
+    return settings.REPLICA_ALIAS in settings.DATABASES
+
+
+@register()
+def verificar_cache_compartida(app_configs, **kwargs):
+    """Con réplica, un usuario fijado en un worker debe leer de la principal en todos los demás"""
+    if replica_configurada() and settings.CACHES['default']['BACKEND'] in CACHES_POR_PROCESO:
+        return [Error(
+            'La réplica de lectura requiere una caché compartida entre procesos',
+            hint=(
+                'Definir CACHE_BACKEND con Redis, Memcached o la base de datos: con una caché por proceso '
+                'un usuario que acaba de escribir puede leer datos atrasados de la réplica en otro worker.'
+            ),
+            id='elohimcoban.E001',
+        )]
+    return []
+
+
+def cache_key_fijado(usuario_id):
+    return f'replica_fijado:{usuario_id}'
+
+
+def usuario_fijado(usuario):
+    """True si el usuario escribió hace poco y debe seguir leyendo de la principal"""
+    return bool(usuario and usuario.is_authenticated and cache.get(cache_key_fijado(usuario.pk)))
+
+
+def fijar_usuario(usuario):
+    cache.set(cache_key_fijado(usuario.pk), True, settings.REPLICA_FIJAR_SEGUNDOS)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in APPS_ENRUTADAS:
+            return None
+        estado = estado_peticion.get()
+        if estado is not None and estado.usar_replica and not estado.escribio:
+            return settings.REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in APPS_ENRUTADAS:
+            return None
+        estado = estado_peticion.get()
+        if estado is not None:
+            estado.escribio = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Ambos alias contienen los mismos datos
+        return True
+
+
+class ReplicaMiddleware:
+    """Reinicia el estado de enrutamiento en cada petición y fija al usuario tras una escritura"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # No se restaura al terminar: las respuestas en streaming siguen leyendo después de
+        # salir del middleware y deben usar la misma base que el resto de la petición
+        estado = EstadoReplica()
+        estado_peticion.set(estado)
+        response = self.get_response(request)
+
+        usuario = getattr(request, 'user', None)
+        if estado.escribio and usuario is not None and usuario.is_authenticated:
+            fijar_usuario(usuario)
+        return response
+
+
+class LecturaReplicaMixin:
+    """
+    Opt-in por vista: las acciones listadas en `acciones_replica` leen de la réplica cuando la
+    petición es de solo lectura y el usuario no escribió recientemente.
+    """
+    acciones_replica = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        estado = estado_peticion.get()
+        if (
+            estado is not None
+            and replica_configurada()
+            and request.method in SAFE_METHODS
+            and self.action in self.acciones_replica
+            and not usuario_fijado(request.user)
+        ):
+            estado.usar_replica = True
@@ -39,6 +39,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'elohimcoban.middleware.MetricasMiddleware',
+    'elohimcoban.middleware.RendimientoMiddleware',
+    'elohimcoban.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -81,9 +84,95 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD', default='postgres'),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        # Segundos que se reutiliza una conexión entre peticiones (0 = una conexión por petición)
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        # Verificar la conexión reutilizada al inicio de cada petición y reconectar si se cayó
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+        # Con un pooler externo (PgBouncer) en modo transacción los cursores del servidor solo
+        # funcionan dentro de una transacción; los reportes en streaming ya los abren dentro de
+        # transaction.atomic(). Activar solo si se agrega código que use .iterator() fuera de una.
+        'DISABLE_SERVER_SIDE_CURSORS': config('DB_DISABLE_SERVER_SIDE_CURSORS', default=False, cast=bool),
     }
 }
 
+# Réplica de solo lectura opcional (elohimcoban.routers). Se habilita al definir DB_REPLICA_HOST o
+# DB_REPLICA_NAME; los demás valores se toman de la base principal si no se indican.
+REPLICA_ALIAS = 'replica'
+
+if config('DB_REPLICA_HOST', default='') or config('DB_REPLICA_NAME', default=''):
+    DATABASES[REPLICA_ALIAS] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        'HOST': config('DB_REPLICA_HOST', default=DATABASES['default']['HOST']),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        # En los tests la réplica apunta a la misma base de pruebas que la principal
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['elohimcoban.routers.ReplicaRouter']
+
+# Segundos que un usuario sigue leyendo de la principal después de escribir (retraso de replicación)
+REPLICA_FIJAR_SEGUNDOS = config('REPLICA_FIJAR_SEGUNDOS', default=10, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Con varios workers de gunicorn conviene un backend compartido (Redis, Memcached o base de datos)
+# para que las invalidaciones lleguen a todos los procesos. Es obligatorio con réplica de lectura.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='elohimcoban'),
+    }
+}
+
+# Segundos que se mantiene en caché la lista de IDs del banco de preguntas de cada tema
+PREGUNTAS_CACHE_TIMEOUT = config('PREGUNTAS_CACHE_TIMEOUT', default=300, cast=int)
+
+# Segundos que se mantiene en caché el alcance de inscripciones (promociones y cursos) de cada alumno
+ALCANCE_CACHE_TIMEOUT = config('ALCANCE_CACHE_TIMEOUT', default=300, cast=int)
+
+
+# Instrumentación de rendimiento (elohimcoban.middleware.RendimientoMiddleware)
+# Fracción de peticiones instrumentadas: 0 desactiva, 1 instrumenta todas
+RENDIMIENTO_MUESTREO = config('RENDIMIENTO_MUESTREO', default=0.05, cast=float)
+
+# Repeticiones de una misma consulta en una petición a partir de las cuales se reporta como posible N+1
+RENDIMIENTO_UMBRAL_DUPLICADAS = config('RENDIMIENTO_UMBRAL_DUPLICADAS', default=3, cast=int)
+
+# Métricas en /metrics (elohimcoban.metricas)
+# Con varios workers de gunicorn definir un directorio compartido y vaciarlo al iniciar el despliegue
+METRICAS_DIRECTORIO = config('METRICAS_DIRECTORIO', default='')
+
+# Segundos entre volcados del estado de cada proceso al directorio de métricas
+METRICAS_INTERVALO_VOLCADO = config('METRICAS_INTERVALO_VOLCADO', default=5, cast=float)
+
+# Segundos sin actividad tras los cuales un usuario deja de contarse como activo
+METRICAS_VENTANA_ACTIVOS = config('METRICAS_VENTANA_ACTIVOS', default=300, cast=int)
+
+# Token bearer exigido para leer /metrics; sin token solo se exponen con DEBUG activo
+METRICAS_TOKEN = config('METRICAS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'elohimcoban.rendimiento': {
+            'handlers': ['console'],
+            'level': config('RENDIMIENTO_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -125,6 +214,31 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Segundos que se conserva un archivo de material sin referencias antes de borrarlo, para no
+# eliminar el de una subida en curso con el mismo contenido
+MATERIALES_GRACIA_HUERFANOS = config('MATERIALES_GRACIA_HUERFANOS', default=600, cast=int)
+
+# Derivados de materiales (cursos.derivados): miniaturas, vistas previas y versiones comprimidas.
+# Se generan en un pool de hilos en segundo plano; con DERIVADOS_ASINCRONO=False, en la misma petición
+DERIVADOS_ASINCRONO = config('DERIVADOS_ASINCRONO', default=True, cast=bool)
+DERIVADOS_TRABAJADORES = config('DERIVADOS_TRABAJADORES', default=2, cast=int)
+
+# Subidas reanudables de materiales (SubidaMaterial): directorio de los archivos parciales,
+# fuera de MEDIA_ROOT para que no se publiquen, y límites de tamaño en bytes
+SUBIDAS_DIRECTORIO = config('SUBIDAS_DIRECTORIO', default=os.path.join(BASE_DIR, 'subidas_temporales'))
+SUBIDAS_TAMANO_MAXIMO = config('SUBIDAS_TAMANO_MAXIMO', default=2 * 1024 ** 3, cast=int)
+SUBIDAS_TAMANO_MAXIMO_FRAGMENTO = config('SUBIDAS_TAMANO_MAXIMO_FRAGMENTO', default=16 * 1024 ** 2, cast=int)
+
+# Horas sin actividad tras las cuales limpiar_materiales descarta una subida sin finalizar
+SUBIDAS_EXPIRACION_HORAS = config('SUBIDAS_EXPIRACION_HORAS', default=24, cast=int)
+
+# Quién transfiere los archivos de materiales tras verificar permisos (cursos.descargas):
+# "django" (el worker), "nginx" (X-Accel-Redirect) o "apache" (X-Sendfile de mod_xsendfile)
+DESCARGAS_SERVIDOR = config('DESCARGAS_SERVIDOR', default='django')
+
+# Location interna de nginx que apunta a MEDIA_ROOT (solo con DESCARGAS_SERVIDOR=nginx)
+DESCARGAS_PREFIJO_INTERNO = config('DESCARGAS_PREFIJO_INTERNO', default='/media-protegida/')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -152,7 +266,7 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
-CORS_EXPOSE_HEADERS = ['Content-Disposition', 'Content-Type']
+CORS_EXPOSE_HEADERS = ['Content-Disposition', 'Content-Type', 'Server-Timing', 'ETag', 'Accept-Ranges', 'Content-Range']
 
 # JWT Settings
 from datetime import timedelta
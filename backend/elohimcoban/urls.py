@@ -6,10 +6,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metricas import vista_metricas
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('cursos.urls')),
     path('api/auth/', include('usuarios.urls')),
+    path('metrics', vista_metricas, name='metricas'),
 ]
 
 if settings.DEBUG: